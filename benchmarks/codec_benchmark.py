@@ -0,0 +1,131 @@
+"""Microbenchmark the tutorial resource document codec.
+
+Times shuttle.codec against the previous implementation of
+DeskTutorials.make_resource_document and parse_resource_document,
+on generated articles of realistic sizes.
+
+    $ python benchmarks/codec_benchmark.py --sizes 2000,20000,200000
+"""
+
+import optparse
+import os
+import sys
+import timeit
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+from shuttle.codec import (  # noqa: E402
+    decode_document,
+    encode_document,
+)
+
+
+def previous_encode(title, content):
+
+    assert "<html>" not in content
+    assert "<body>" not in content
+
+    return """
+        <html>
+        <head><title>%(title)s</title></head>
+        <body>
+        %(content)s
+        </body>
+        """ % dict(
+        title=title,
+        content=content,
+    )
+
+
+def previous_decode(content):
+
+    content = content.strip()
+
+    if not content.startswith('<html>'):
+        return dict(body=content)
+
+    result = {}
+    if '<title>' in content and '</title>' in content:
+        result['subject'] = content[content.find('<title>') + 7:content.find('</title>')].strip()
+    result['body'] = content[content.find('<body>') + 6:content.find('</body>')].strip()
+
+    return result
+
+
+# hand-edited documents the codec must read as before
+MALFORMED_DOCUMENTS = (
+    u'<html><head><title>T</title><body>x</body>',
+    u'<html><head><meta charset="utf-8"><title>T</title>\n<body>\nx\n</body>\n</html>',
+    u'<html><head></head><body>x</body>',
+    u'<html><title>T</title><body>x</body>',
+    u'<html><body>x</body>',
+    u'x',
+)
+
+
+def make_article(size):
+    """Return an article body of about size characters of HTML."""
+
+    paragraph = (
+        u'<p>To add a ticket type, open <strong>Manage</strong> and choose '
+        u'<a href="https://example.com/help/tickets">Tickets</a>. '
+        u'Pr\xe9cisez le prix et la quantit\xe9.</p>\n'
+        u'<ul>\n<li>Free</li>\n<li>Paid</li>\n<li>Donation</li>\n</ul>\n'
+    )
+
+    return (paragraph * (size // len(paragraph) + 1))[:size]
+
+
+def best_of(func, repeat, number):
+
+    return min(timeit.repeat(func, repeat=repeat, number=number)) / number
+
+
+def main():
+
+    parser = optparse.OptionParser()
+    parser.add_option('--sizes', default='2000,20000,200000',
+                      help="Comma delimited article sizes, in characters")
+    parser.add_option('--number', type='int', default=200,
+                      help="Calls per timing")
+    parser.add_option('--repeat', type='int', default=5,
+                      help="Timings per measurement; the best is reported")
+    options, args = parser.parse_args()
+
+    for document in MALFORMED_DOCUMENTS:
+        assert decode_document(document) == previous_decode(document), document
+
+    title = u'How to add ticket types (12345)'
+    row = '%-8s %-8s %14s %14s %8s\n'
+    sys.stdout.write(row % ('size', 'op', 'previous (us)', 'codec (us)', 'speedup'))
+
+    for size in [int(s) for s in options.sizes.split(',')]:
+        body = make_article(size)
+        document = encode_document(title, body)
+
+        # the codec must produce and read the same documents as before
+        assert document == previous_encode(title, body)
+        assert decode_document(document) == previous_decode(document)
+
+        for op, previous, current in (
+                ('encode',
+                 lambda: previous_encode(title, body),
+                 lambda: encode_document(title, body)),
+                ('decode',
+                 lambda: previous_decode(document),
+                 lambda: decode_document(document)),
+        ):
+            before = best_of(previous, options.repeat, options.number)
+            after = best_of(current, options.repeat, options.number)
+            sys.stdout.write(row % (
+                size, op,
+                '%.2f' % (before * 1e6, ),
+                '%.2f' % (after * 1e6, ),
+                '%.2fx' % (before / after, ),
+            ))
+
+
+if __name__ == '__main__':
+    main()
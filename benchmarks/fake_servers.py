@@ -0,0 +1,503 @@
+"""In-memory stand-ins for the Desk v2 and Transifex v2 APIs.
+
+Only the endpoints used by shuttle are implemented. Each service is
+seeded from a fixed random seed, so runs against the same parameters
+see the same content, and can inject latency and transient errors.
+"""
+
+import collections
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import urllib
+import urlparse
+from BaseHTTPServer import (
+    BaseHTTPRequestHandler,
+    HTTPServer,
+)
+from SocketServer import ThreadingMixIn
+
+
+# locales used for the generated content, in order; more are made up
+LOCALES = (
+    'fr_FR', 'de_DE', 'es_ES', 'it_IT', 'pt_BR', 'nl_NL', 'sv_SE',
+    'da_DK', 'fi_FI', 'nb_NO', 'pl_PL', 'ja_JP', 'ko_KR', 'zh_CN',
+    'zh_TW', 'ru_RU', 'tr_TR', 'cs_CZ', 'hu_HU', 'el_GR',
+)
+
+ENGLISH_LOCALE = 'en_GB'
+
+
+def make_locales(count):
+    """Return count Transifex-style locales, plus ENGLISH_LOCALE."""
+
+    locales = list(LOCALES[:count])
+    locales.extend('x%d_XX' % (n, ) for n in range(len(locales), count))
+
+    return locales + [ENGLISH_LOCALE]
+
+
+def translate(text, locale):
+
+    return u'%s [%s]' % (text, locale)
+
+
+class FakeService(object):
+    """Base class of the fake APIs.
+
+    Subclasses list their ``routes`` as (method, path regex, method
+    name) tuples and build their content in ``seed``. Requests are
+    delayed by around ``latency`` seconds and fail with a 503 with
+    probability ``error_rate``. Successful GETs carry an ETag and are
+    answered with a 304 when it matches If-None-Match.
+    """
+
+    routes = ()
+
+    def __init__(self, latency=0, error_rate=0, seed=0, **content):
+
+        self.latency = latency
+        self.error_rate = error_rate
+        self.content = content
+        self._seed = seed
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Restore the seeded content and clear the request counts."""
+
+        with self._lock:
+            self.random = random.Random(self._seed)
+            self.requests = collections.Counter()
+            self.seed(random.Random(self._seed), **self.content)
+
+    def seed(self, rand, **content):
+        raise NotImplementedError
+
+    def handle(self, method, url, body, if_none_match=None):
+        """Return (status, headers, content) for a request."""
+
+        status, payload = self.dispatch(method, url, body)
+        content = json.dumps(payload)
+        headers = {'Content-Type': 'application/json'}
+
+        if method == 'GET' and status == 200:
+            headers['ETag'] = '"%s"' % (hashlib.md5(content).hexdigest(), )
+            if if_none_match == headers['ETag']:
+                with self._lock:
+                    self.requests['not_modified'] += 1
+                return 304, headers, ''
+
+        return status, headers, content
+
+    def dispatch(self, method, url, body):
+        """Return (status, payload) for a request."""
+
+        with self._lock:
+            self.requests['requests'] += 1
+            delay = self.latency * self.random.uniform(0.5, 1.5)
+            fail = self.random.random() < self.error_rate
+
+        time.sleep(delay)
+
+        if fail:
+            with self._lock:
+                self.requests['injected_errors'] += 1
+            return 503, {'error': 'injected failure'}
+
+        parsed = urlparse.urlparse(url)
+        for route_method, pattern, name in self.routes:
+            match = re.match(pattern + '$', parsed.path)
+            if route_method == method and match:
+                data = json.loads(body) if body else {}
+                with self._lock:
+                    return getattr(self, name)(
+                        urlparse.parse_qs(parsed.query), data, *match.groups()
+                    )
+
+        return 404, {'error': 'not found'}
+
+
+class FakeDesk(FakeService):
+    """Desk v2 topics and articles, with their translations."""
+
+    PER_PAGE = 50
+
+    # articles are last updated at UPDATED_AT, or EDITED_AT if changed
+    UPDATED_AT = '2014-05-01T12:00:00Z'
+    EDITED_AT = '2014-06-01T12:00:00Z'
+
+    routes = (
+        ('GET', r'/api/v2/(topics|articles)', 'list_objects'),
+        ('GET', r'/api/v2/(topics|articles)/(\d+)', 'get_object'),
+        ('GET', r'/api/v2/(topics|articles)/(\d+)/translations', 'list_translations'),
+        ('POST', r'/api/v2/(topics|articles)/(\d+)/translations', 'create_translation'),
+        ('PATCH', r'/api/v2/(topics|articles)/(\d+)/translations/([^/]+)', 'update_translation'),
+    )
+
+    def seed(self, rand, locales=(), topics=0, articles=0, changed=0, body_size=1000):
+
+        self.objects = dict(topics=collections.OrderedDict(), articles=collections.OrderedDict())
+        self.translations = {}
+
+        for n in range(1, topics + 1):
+            self.objects['topics'][str(n)] = dict(
+                name=u'Topic %d' % (n, ),
+                description=u'About topic %d' % (n, ),
+                in_support_center=True,
+                show_in_portal=True,
+            )
+            # topics are written with the locales as given to shuttle,
+            # articles with the lower case Desk locales
+            self.translations[('topics', str(n))] = dict(
+                (locale, dict(
+                    locale=locale,
+                    # translations that differ are rewritten by a sync
+                    name=translate(u'Topic %d' % (n, ), locale)
+                    if rand.random() >= changed else u'Old topic %d' % (n, ),
+                    description=u'About topic %d' % (n, ),
+                    in_support_center=True,
+                ))
+                for locale in locales
+            )
+
+        body = u'<p>%s</p>' % (u'lorem ipsum ' * (body_size // 12), )
+        for n in range(1, articles + 1):
+            self.objects['articles'][str(n)] = dict(
+                id=n,
+                subject=u'Article %d' % (n, ),
+                body=body,
+                updated_at=self.UPDATED_AT,
+            )
+            self.translations[('articles', str(n))] = dict(
+                (locale.lower(), dict(
+                    locale=locale.lower(),
+                    subject=translate(u'Article %d' % (n, ), locale),
+                    body=translate(body, locale),
+                    outdated=rand.random() < changed,
+                    out_of_date=rand.random() < changed,
+                ))
+                for locale in locales
+            )
+
+            # editing an article leaves its translations out of date
+            if any(
+                    t['outdated'] or t['out_of_date']
+                    for t in self.translations[('articles', str(n))].values()
+            ):
+                self.objects['articles'][str(n)]['updated_at'] = self.EDITED_AT
+
+    def entry(self, kind, object_id, fields):
+
+        href = '/api/v2/%s/%s' % (kind, object_id)
+        return dict(fields, _links=dict(
+            self=dict(href=href, **{'class': kind[:-1]}),
+            translations=dict(
+                href='%s/translations' % (href, ),
+                **{'class': '%s_translation' % (kind[:-1], )}
+            ),
+        ))
+
+    def translation_entry(self, kind, object_id, fields):
+
+        return dict(fields, _links=dict(self=dict(
+            href='/api/v2/%s/%s/translations/%s' % (kind, object_id, fields['locale']),
+            **{'class': '%s_translation' % (kind[:-1], )}
+        )))
+
+    def page(self, path, query, entries):
+
+        page = int(query.get('page', ['1'])[0])
+        per_page = int(query.get('per_page', [self.PER_PAGE])[0])
+        start = (page - 1) * per_page
+        links = {}
+        if start + per_page < len(entries):
+            # like Desk, keep the sort order from page to page
+            next_query = dict((k, v[0]) for k, v in query.items())
+            next_query.update(page=page + 1, per_page=per_page)
+            links['next'] = dict(href='%s?%s' % (
+                path, urllib.urlencode(sorted(next_query.items())),
+            ))
+
+        return 200, dict(
+            total_entries=len(entries),
+            _embedded=dict(entries=entries[start:start + per_page]),
+            _links=links,
+        )
+
+    def list_objects(self, query, data, kind):
+
+        entries = [
+            self.entry(kind, object_id, fields)
+            for object_id, fields in self.objects[kind].items()
+        ]
+        if 'sort_field' in query:
+            entries.sort(
+                key=lambda entry: entry.get(query['sort_field'][0]),
+                reverse=query.get('sort_direction') == ['desc'],
+            )
+
+        return self.page('/api/v2/%s' % (kind, ), query, entries)
+
+    def get_object(self, query, data, kind, object_id):
+
+        if object_id not in self.objects[kind]:
+            return 404, {'message': 'Resource Not Found'}
+
+        return 200, self.entry(kind, object_id, self.objects[kind][object_id])
+
+    def list_translations(self, query, data, kind, object_id):
+
+        return self.page(
+            '/api/v2/%s/%s/translations' % (kind, object_id), query, [
+                self.translation_entry(kind, object_id, fields)
+                for _, fields in sorted(self.translations[(kind, object_id)].items())
+            ],
+        )
+
+    def create_translation(self, query, data, kind, object_id):
+
+        self.translations[(kind, object_id)][data['locale']] = data
+        return 201, self.translation_entry(kind, object_id, data)
+
+    def update_translation(self, query, data, kind, object_id, locale):
+
+        translation = self.translations[(kind, object_id)].get(locale)
+        if translation is None:
+            return 404, {'message': 'Resource Not Found'}
+
+        translation.update(data)
+        return 200, self.translation_entry(kind, object_id, translation)
+
+
+class FakeTransifex(FakeService):
+    """The Transifex /api/2/ projects, resources, statistics and translations."""
+
+    # translations are never updated while a benchmark runs
+    LAST_UPDATE = '2014-06-01 12:00:00'
+
+    routes = (
+        ('GET', r'/api/2/projects/', 'list_projects'),
+        ('POST', r'/api/2/projects/', 'create_project'),
+        ('GET', r'/api/2/project/([^/]+)/', 'get_project'),
+        ('GET', r'/api/2/project/([^/]+)/resources/', 'list_resources'),
+        ('POST', r'/api/2/project/([^/]+)/resources/', 'create_resource'),
+        ('GET', r'/api/2/project/([^/]+)/resource/([^/]+)/', 'get_resource'),
+        ('PUT', r'/api/2/project/([^/]+)/resource/([^/]+)/', 'update_resource'),
+        ('PUT', r'/api/2/project/([^/]+)/resource/([^/]+)/content/', 'update_content'),
+        ('GET', r'/api/2/project/([^/]+)/resource/([^/]+)/stats/', 'get_statistics'),
+        ('GET', r'/api/2/project/([^/]+)/resource/([^/]+)/translation/([^/]+)/?', 'get_translation'),
+        ('GET', r'/api/2/project/([^/]+)/language/([^/]+)/', 'get_language'),
+    )
+
+    def seed(self, rand, locales=(), topics=0, articles=0, complete=1.0,
+             body_size=1000, topics_project='topics', tutorials_project='tutorials'):
+
+        self.projects = collections.OrderedDict()
+        self.resources = collections.OrderedDict()
+        self.translations = {}
+        self.completed = {}
+
+        locales = [locale for locale in locales if not locale.lower().startswith('en')]
+
+        self.projects[topics_project] = dict(
+            slug=topics_project, name='Topics', last_updated=self.LAST_UPDATE,
+        )
+        self.resources[(topics_project, 'desk-topics')] = dict(
+            slug='desk-topics', name='Help Center Topics', i18n_type='PO',
+        )
+        for locale in locales:
+            self.translations[(topics_project, 'desk-topics', locale)] = u''.join(
+                u'msgid "Topic %d"\nmsgstr "%s"\n\n' % (
+                    n, translate(u'Topic %d' % (n, ), locale),
+                )
+                for n in range(1, topics + 1)
+            )
+            self.completed[(topics_project, 'desk-topics', locale)] = '100%'
+
+        body = u'<p>%s</p>' % (u'lorem ipsum ' * (body_size // 12), )
+        for locale in locales:
+            project_slug = '%s-%s' % (tutorials_project, locale)
+            self.projects[project_slug] = dict(
+                slug=project_slug, name=project_slug, last_updated=self.LAST_UPDATE,
+            )
+
+            for n in range(1, articles + 1):
+                self.resources[(project_slug, str(n))] = dict(
+                    slug=str(n), name=u'Article %d' % (n, ), i18n_type='HTML',
+                )
+                self.translations[(project_slug, str(n), locale)] = (
+                    u'<html><head><title>%s</title></head><body>%s</body>' % (
+                        translate(u'Article %d' % (n, ), locale),
+                        translate(body, locale),
+                    )
+                )
+                self.completed[(project_slug, str(n), locale)] = (
+                    '100%' if rand.random() < complete else '50%'
+                )
+
+    def now(self):
+
+        return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+
+    def list_projects(self, query, data):
+
+        return 200, list(self.projects.values())
+
+    def create_project(self, query, data):
+
+        self.projects[data['slug']] = dict(data, last_updated=self.now())
+        return 201, data
+
+    def get_project(self, query, data, project_slug):
+
+        if project_slug not in self.projects:
+            return 404, 'Not Found'
+
+        return 200, self.projects[project_slug]
+
+    def list_resources(self, query, data, project_slug):
+
+        if project_slug not in self.projects:
+            return 404, 'Not Found'
+
+        return 200, [
+            resource for (project, _), resource in self.resources.items()
+            if project == project_slug
+        ]
+
+    def create_resource(self, query, data, project_slug):
+
+        if project_slug not in self.projects:
+            return 404, 'Not Found'
+
+        self.resources[(project_slug, data['slug'])] = dict(
+            (k, v) for k, v in data.items() if k != 'content'
+        )
+        self.projects[project_slug]['last_updated'] = self.now()
+        return 201, [1, 0, 0]
+
+    def get_resource(self, query, data, project_slug, slug):
+
+        if (project_slug, slug) not in self.resources:
+            return 404, 'Not Found'
+
+        return 200, self.resources[(project_slug, slug)]
+
+    def update_resource(self, query, data, project_slug, slug):
+
+        if (project_slug, slug) not in self.resources:
+            return 404, 'Not Found'
+
+        self.resources[(project_slug, slug)].update(data)
+        self.projects[project_slug]['last_updated'] = self.now()
+        return 200, 'OK'
+
+    def update_content(self, query, data, project_slug, slug):
+
+        if (project_slug, slug) not in self.resources:
+            return 404, 'Not Found'
+
+        self.projects[project_slug]['last_updated'] = self.now()
+        return 200, dict(strings_added=0, strings_updated=1, strings_delete=0)
+
+    def get_statistics(self, query, data, project_slug, slug):
+
+        if (project_slug, slug) not in self.resources:
+            return 404, 'Not Found'
+
+        return 200, dict(
+            (lang, dict(completed=completed, last_update=self.LAST_UPDATE))
+            for (project, resource, lang), completed in self.completed.items()
+            if (project, resource) == (project_slug, slug)
+        )
+
+    def get_translation(self, query, data, project_slug, slug, lang):
+
+        content = self.translations.get((project_slug, slug, lang))
+        if content is None:
+            return 404, 'Not Found'
+
+        return 200, dict(content=content, mimetype='text/html')
+
+    def get_language(self, query, data, project_slug, lang):
+
+        if project_slug not in self.projects:
+            return 404, 'Not Found'
+
+        # one segment per resource
+        completed = [
+            completed for (project, _, resource_lang), completed in self.completed.items()
+            if project == project_slug and resource_lang == lang
+        ]
+        translated = completed.count('100%')
+        return 200, dict(
+            language_code=lang,
+            total_segments=len(completed),
+            translated_segments=translated,
+            untranslated_segments=len(completed) - translated,
+        )
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    # keep-alive responses are written in pieces; don't let Nagle's
+    # algorithm hold them back
+    disable_nagle_algorithm = True
+
+    def _handle(self):
+
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else None
+
+        status, headers, content = self.server.service.handle(
+            self.command, self.path, body, self.headers.get('If-None-Match'),
+        )
+
+        self.send_response(status)
+        for header, value in headers.items():
+            self.send_header(header, value)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = _handle
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeServer(ThreadingMixIn, HTTPServer):
+    """Serve a FakeService on a local port from a background thread."""
+
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, service):
+
+        HTTPServer.__init__(self, ('127.0.0.1', 0), _RequestHandler)
+        self.service = service
+        self._thread = None
+
+    @property
+    def url(self):
+
+        return 'http://127.0.0.1:%d' % (self.server_port, )
+
+    def start(self):
+
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+        return self.url
+
+    def stop(self):
+
+        self.shutdown()
+        self.server_close()
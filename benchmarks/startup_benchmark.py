@@ -0,0 +1,139 @@
+"""Measure the startup cost of the shuttle command.
+
+Times ``shuttle --help`` and a single-resource tutorials push against
+the fake servers, each as a complete new process, and exits with
+status 1 if the median time of either exceeds its budget. Also checks
+which slow-to-import dependencies are loaded by importing shuttle.sync.
+
+    $ python benchmarks/startup_benchmark.py --runs 20
+"""
+
+import json
+import optparse
+import os
+import subprocess
+import sys
+import time
+
+from fake_servers import (
+    FakeDesk,
+    FakeServer,
+    FakeTransifex,
+    make_locales,
+)
+from sync_benchmark import (
+    TOPICS_PROJECT_SLUG,
+    TUTORIALS_PROJECT_SLUG,
+)
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# dependencies which should only be imported once they are needed
+HEAVY_MODULES = ('babel', 'deskapi', 'django', 'requests', 'txlib_too')
+
+
+def environment():
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [os.path.join(ROOT, 'src')] +
+        [p for p in env.get('PYTHONPATH', '').split(os.pathsep) if p]
+    )
+
+    return env
+
+
+def time_process(command, runs):
+    """Return the sorted wall times of running command runs times."""
+
+    times = []
+    with open(os.devnull, 'w') as devnull:
+        for _ in range(runs):
+            start = time.time()
+            subprocess.check_call(command, stdout=devnull, stderr=devnull,
+                                  env=environment())
+            times.append(time.time() - start)
+
+    return sorted(times)
+
+
+def heavy_imports():
+    """Return the slow dependencies loaded by importing shuttle.sync."""
+
+    output = subprocess.check_output([
+        sys.executable, '-c',
+        'import json, sys; import shuttle.sync; '
+        'print(json.dumps(sorted(set(m.split(".")[0] for m in sys.modules))))',
+    ], env=environment())
+
+    return [m for m in json.loads(output) if m in HEAVY_MODULES]
+
+
+def main():
+
+    parser = optparse.OptionParser()
+    parser.add_option('--runs', type='int', default=10, help="Runs of each command")
+    parser.add_option('--help-budget', type='float', default=0.1,
+                      help="Budget for the median time of shuttle --help, in seconds")
+    parser.add_option('--run-budget', type='float', default=0.5,
+                      help="Budget for the median time of a single-resource push, in seconds")
+    options, args = parser.parse_args()
+
+    heavy = heavy_imports()
+    sys.stdout.write('slow imports loaded by shuttle.sync: %s\n' % (
+        ', '.join(heavy) or 'none',
+    ))
+
+    locales = make_locales(3)
+    content = dict(locales=locales, topics=10, articles=10)
+    desk = FakeServer(FakeDesk(**content))
+    tx = FakeServer(FakeTransifex(
+        topics_project=TOPICS_PROJECT_SLUG,
+        tutorials_project=TUTORIALS_PROJECT_SLUG,
+        **content
+    ))
+    desk.start()
+    tx.start()
+
+    single_resource = json.dumps(dict(
+        desk_url=desk.url,
+        tx_url=tx.url,
+        args=['-t', 'tutorials', '--push', '--force', '-r', '1',
+              '--locales', ','.join(locales)],
+    ))
+
+    try:
+        results = (
+            ('shuttle --help', options.help_budget, time_process(
+                [sys.executable, '-c',
+                 'import sys; from shuttle.sync import main; main(sys.argv[1:])',
+                 '--help'],
+                options.runs,
+            )),
+            ('single-resource push', options.run_budget, time_process(
+                [sys.executable, os.path.join(HERE, 'sync_benchmark.py'),
+                 '--child', single_resource],
+                options.runs,
+            )),
+        )
+    finally:
+        desk.stop()
+        tx.stop()
+
+    over_budget = False
+    for name, budget, times in results:
+        median = times[len(times) // 2]
+        sys.stdout.write('%-22s min %.3fs  median %.3fs  budget %.3fs  %s\n' % (
+            name, times[0], median, budget,
+            'ok' if median <= budget else 'OVER BUDGET',
+        ))
+        over_budget = over_budget or median > budget
+
+    if over_budget or heavy:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
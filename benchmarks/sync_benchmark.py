@@ -0,0 +1,218 @@
+"""Benchmark shuttle sync runs against local fake Desk and Transifex APIs.
+
+Each scenario runs ``shuttle.sync.main`` in a fresh Python process
+against freshly seeded fake servers, and reports its wall time, the
+requests each service received and the peak RSS of the sync process.
+
+    $ python benchmarks/sync_benchmark.py --articles 500 --locales 10 --latency 0.05
+
+Arguments after ``--`` are passed on to shuttle, for example
+``-- --workers 8 --concurrency 20``. The sync log of each scenario is
+written to ``<scenario>.log`` in the --log-dir, if given.
+"""
+
+import collections
+import json
+import optparse
+import os
+import resource
+import subprocess
+import sys
+import time
+
+from fake_servers import (
+    FakeDesk,
+    FakeServer,
+    FakeTransifex,
+    make_locales,
+)
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+TOPICS_PROJECT_SLUG = 'topics'
+TUTORIALS_PROJECT_SLUG = 'tutorials'
+
+SCENARIOS = collections.OrderedDict((
+    ('tutorials-push', ['-t', 'tutorials', '--push']),
+    ('tutorials-pull', ['-t', 'tutorials', '--pull']),
+    ('topics-push', ['-t', 'topics', '--push']),
+    ('topics-pull', ['-t', 'topics', '--pull']),
+    ('english_topics-pull', ['-t', 'english_topics', '--pull']),
+    ('english_tutorials-pull', ['-t', 'english_tutorials', '--pull']),
+    ('all', ['-t', 'all', '--push', '--pull']),
+))
+
+
+def parse_args():
+
+    parser = optparse.OptionParser(usage='%prog [options] [-- shuttle options]')
+    parser.add_option('--articles', type='int', default=200, help="Number of Desk articles")
+    parser.add_option('--topics', type='int', default=50, help="Number of Desk topics")
+    parser.add_option('--locales', type='int', default=5, help="Number of translated locales")
+    parser.add_option('--body-size', type='int', default=2000, help="Article body size, in bytes")
+    parser.add_option(
+        '--latency', type='float', default=0.02,
+        help="Mean latency of every fake API request, in seconds",
+    )
+    parser.add_option(
+        '--error-rate', type='float', default=0,
+        help="Fraction of requests failing with a 503",
+    )
+    parser.add_option(
+        '--changed', type='float', default=0.1,
+        help="Fraction of Desk translations that are out of date",
+    )
+    parser.add_option(
+        '--complete', type='float', default=0.9,
+        help="Fraction of Transifex translations that are complete",
+    )
+    parser.add_option(
+        '-s', '--scenarios', default=','.join(SCENARIOS),
+        help="Comma delimited scenarios to run: %s" % (', '.join(SCENARIOS), ),
+    )
+    parser.add_option('--log-dir', help="Directory for the sync log of each scenario")
+    parser.add_option('--output', help="Also write the results as JSON to this file")
+    parser.add_option('--child', help=optparse.SUPPRESS_HELP)
+
+    return parser.parse_args()
+
+
+def run_child(config):
+    """Run one sync in this process and print its measurements as JSON."""
+
+    sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+    from django.conf import settings
+    settings.configure(
+        DESK_SITENAME='benchmark',
+        DESK_BASE_URL=config['desk_url'],
+        DESK_USER='user',
+        DESK_PASSWD='password',
+        TRANSIFEX_HOST=config['tx_url'],
+        TRANSIFEX_USERNAME='user',
+        TRANSIFEX_PASSWORD='password',
+        TOPICS_PROJECT_SLUG=TOPICS_PROJECT_SLUG,
+        TUTORIALS_PROJECT_SLUG=TUTORIALS_PROJECT_SLUG,
+    )
+
+    from shuttle import sync
+    from shuttle.metrics import default_request_log
+
+    status = 0
+    start = time.time()
+    try:
+        sync.main(config['args'])
+    except SystemExit as e:
+        status = e.code
+    wall = time.time() - start
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    sys.stdout.write(json.dumps(dict(
+        status=status,
+        wall=wall,
+        cpu=usage.ru_utime + usage.ru_stime,
+        # ru_maxrss is in kilobytes on Linux, bytes on OS X
+        peak_rss_mb=usage.ru_maxrss / (1024.0 ** (2 if sys.platform == 'darwin' else 1)),
+        client_requests=dict(default_request_log.requests),
+    )))
+
+
+def run_scenario(name, args, desk, tx, log_dir=None):
+    """Run scenario name in a child process; return its measurements."""
+
+    for server in (desk, tx):
+        server.service.reset()
+
+    config = dict(desk_url=desk.url, tx_url=tx.url, args=args)
+    log_path = os.path.join(log_dir, '%s.log' % (name, )) if log_dir else os.devnull
+    with open(log_path, 'w') as log_file:
+        output = subprocess.check_output(
+            [sys.executable, os.path.abspath(__file__), '--child', json.dumps(config)],
+            stderr=log_file,
+        )
+
+    result = json.loads(output)
+    result.update(
+        scenario=name,
+        desk_requests=desk.service.requests['requests'],
+        tx_requests=tx.service.requests['requests'],
+        injected_errors=(
+            desk.service.requests['injected_errors'] +
+            tx.service.requests['injected_errors']
+        ),
+    )
+
+    return result
+
+
+def main():
+
+    options, shuttle_args = parse_args()
+
+    if options.child:
+        return run_child(json.loads(options.child))
+
+    locales = make_locales(options.locales)
+    content = dict(
+        locales=locales,
+        topics=options.topics,
+        articles=options.articles,
+        body_size=options.body_size,
+    )
+    faults = dict(latency=options.latency, error_rate=options.error_rate)
+
+    desk = FakeServer(FakeDesk(changed=options.changed, **dict(content, **faults)))
+    tx = FakeServer(FakeTransifex(
+        complete=options.complete,
+        topics_project=TOPICS_PROJECT_SLUG,
+        tutorials_project=TUTORIALS_PROJECT_SLUG,
+        **dict(content, **faults)
+    ))
+    desk.start()
+    tx.start()
+
+    if options.log_dir and not os.path.isdir(options.log_dir):
+        os.makedirs(options.log_dir)
+
+    results = []
+    row = '%-24s %8s %8s %8s %8s %8s %10s %6s\n'
+    sys.stdout.write(row % (
+        'scenario', 'wall(s)', 'cpu(s)', 'desk', 'tx', 'errors', 'rss(MB)', 'exit',
+    ))
+
+    try:
+        for name in options.scenarios.split(','):
+            args = SCENARIOS[name.strip()] + [
+                '--locales', ','.join(locales),
+                # the fake servers are not rate limited
+                '--rate-limit', '1000',
+            ] + shuttle_args
+
+            result = run_scenario(name.strip(), args, desk, tx, options.log_dir)
+            results.append(result)
+
+            sys.stdout.write(row % (
+                result['scenario'],
+                '%.2f' % (result['wall'], ),
+                '%.2f' % (result['cpu'], ),
+                result['desk_requests'],
+                result['tx_requests'],
+                result['injected_errors'],
+                '%.1f' % (result['peak_rss_mb'], ),
+                result['status'],
+            ))
+            sys.stdout.flush()
+
+    finally:
+        desk.stop()
+        tx.stop()
+
+    if options.output:
+        with open(options.output, 'w') as output_file:
+            json.dump(dict(options=vars(options), results=results), output_file,
+                      indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
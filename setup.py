@@ -16,6 +16,7 @@ version = '0.8'
 install_requires = [
     'babel',
     'deskapi',
+    'requests',
     'txlib-too',
 ]
 
@@ -40,6 +41,9 @@ setup(
     install_requires=install_requires,
     entry_points={
         'console_scripts':
-            ['shuttle=shuttle.sync:main']
+            [
+                'shuttle=shuttle.sync:main',
+                'shuttle-daemon=shuttle.daemon:main',
+            ]
     },
 )
@@ -0,0 +1,92 @@
+import re
+
+
+# the HTML document uploaded to Transifex for each tutorial; the layout
+# must not change, or every resource would be seen as modified
+_DOCUMENT_START = u"""
+        <html>
+        <head><title>"""
+_DOCUMENT_MIDDLE = u"""</title></head>
+        <body>
+        """
+_DOCUMENT_END = u"""
+        </body>
+        """
+
+# everything before the body: the html tag and the head, which may be
+# left open up to the body tag, or a bare title
+_PREAMBLE = re.compile(
+    r'\s*<html>\s*'
+    r'(?:<head>\s*(?:<title>(?P<head_title>.*?)</title>)?(?P<head>.*?)(?:</head>|(?=<body>))'
+    r'|<title>(?P<title>.*?)</title>)?'
+    r'\s*(?:<body>)?\s*',
+    re.DOTALL,
+)
+_TITLE = re.compile(r'<title>(.*?)</title>', re.DOTALL)
+
+_BODY_END = u'</body>'
+_HTML_END = u'</html>'
+
+
+def _rstrip_index(content, start, end):
+    """Return end moved back over any whitespace, but not before start.
+
+    Only the end of content is examined, a window at a time, rather
+    than copying all of it to strip it.
+    """
+
+    while end > start:
+        window = content[max(start, end - 64):end]
+        stripped = len(window.rstrip())
+        end -= len(window) - stripped
+        if stripped:
+            break
+
+    return end
+
+
+def encode_document(title, body):
+    """Return a single HTML document containing the title and body.
+
+    Raises ValueError if body contains an <html> or <body> tag.
+    """
+
+    if u'<html>' in body or u'<body>' in body:
+        raise ValueError('The body of a document may not contain <html> or <body>')
+
+    return u''.join((_DOCUMENT_START, title, _DOCUMENT_MIDDLE, body, _DOCUMENT_END))
+
+
+def decode_document(content):
+    """Return a dict with the subject and body of a document.
+
+    content is scanned once: the preamble is matched from the start,
+    and the closing tags are looked for from the end, so a </body> in
+    the body itself is kept. Closing tags may be missing. Content that
+    is not a full document is returned as the body, without a subject.
+    """
+
+    preamble = _PREAMBLE.match(content)
+    if preamble is None:
+        return dict(body=content.strip())
+
+    start = preamble.end()
+    end = content.rfind(_BODY_END, start)
+    if end < 0 or content[end + len(_BODY_END):].strip() not in (u'', _HTML_END):
+        # no closing body tag; the document may still be closed
+        end = _rstrip_index(content, start, len(content))
+        if content.endswith(_HTML_END, start, end):
+            end -= len(_HTML_END)
+
+    result = dict(body=content[start:_rstrip_index(content, start, end)])
+
+    title = preamble.group('head_title') or preamble.group('title')
+    if title is None and preamble.group('head'):
+        # the title is not the first thing in the head
+        head_title = _TITLE.search(preamble.group('head'))
+        title = head_title and head_title.group(1)
+
+    if title is not None:
+        result['subject'] = title.strip()
+
+    return result
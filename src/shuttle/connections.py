@@ -0,0 +1,173 @@
+import time
+
+import requests
+import requests.adapters
+from requests.compat import urlparse
+from txlib_too.http import http_requests
+from txlib_too.http.auth import AnonymousAuth
+from txlib_too.http.exceptions import NoResponseError
+from txlib_too.utils import _logger
+
+from metrics import default_request_log
+from throttle import (
+    DEFAULT_CONCURRENCY,
+    default_throttle,
+)
+
+
+class ThrottledSession(requests.Session):
+    """A requests Session whose requests go through a Throttle.
+
+    Requests are rate limited per host and retried on transient
+    failures; see shuttle.throttle.Throttle. The connection pool keeps
+    up to pool_size keep-alive connections per host. If base_url is
+    given, requests are sent to it in place of the scheme and host of
+    their URL, for example to point a client at a local stand-in.
+    Requests time out after timeout, a (connect, read) tuple, or the
+    throttle's timeout if it is not given.
+    """
+
+    def __init__(self, service, throttle=None, request_log=None,
+                 pool_size=DEFAULT_CONCURRENCY, base_url=None, timeout=None):
+
+        super(ThrottledSession, self).__init__()
+
+        self.service = service
+        self.throttle = throttle or default_throttle
+        self.request_log = request_log or default_request_log
+        self.base_url = base_url and base_url.rstrip('/')
+        self.timeout = timeout
+
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=pool_size,
+        )
+        self.mount('http://', adapter)
+        self.mount('https://', adapter)
+
+    def request(self, method, url, *args, **kwargs):
+
+        if self.base_url:
+            parsed = urlparse(url)
+            url = '%s%s' % (
+                self.base_url,
+                url[len('%s://%s' % (parsed.scheme, parsed.netloc)):],
+            )
+
+        # a stalled connection would otherwise hold a throttle slot forever
+        kwargs.setdefault('timeout', self.timeout or self.throttle.timeout)
+
+        def send_request():
+            start = time.time()
+            try:
+                response = super(ThrottledSession, self).request(
+                    method, url, *args, **kwargs
+                )
+            except requests.RequestException:
+                self.request_log.record(
+                    self.service, method, time.time() - start,
+                    url=url, status='error',
+                )
+                raise
+
+            # a streamed body has not been read yet; don't read it here
+            if kwargs.get('stream'):
+                bytes_received = int(response.headers.get('Content-Length') or 0)
+            else:
+                bytes_received = len(response.content)
+
+            self.request_log.record(
+                self.service, method, time.time() - start,
+                url=url,
+                status=response.status_code,
+                bytes_sent=len(response.request.body or ''),
+                bytes_received=bytes_received,
+            )
+
+            return response
+
+        return self.throttle.send(urlparse(url).netloc, send_request, method)
+
+
+def desk_session(auth, throttle=None, base_url=None,
+                 pool_size=DEFAULT_CONCURRENCY):
+    """Return a ThrottledSession set up for the Desk API."""
+
+    session = ThrottledSession('desk', throttle, pool_size=pool_size,
+                               base_url=base_url)
+    session.auth = auth
+    session.headers.update({
+        'Accept': 'application/json',
+        'Content-Type': 'application/json',
+    })
+
+    return session
+
+
+class PooledHttpRequest(http_requests.HttpRequest):
+    """txlib_too HTTP handler that reuses keep-alive connections.
+
+    All requests go through a single ThrottledSession whose connection
+    pool holds up to ``concurrency`` connections; the number of requests
+    in flight is limited by the session's Throttle. The handler is safe
+    to share between threads.
+    """
+
+    def __init__(self, hostname, auth=AnonymousAuth(),
+                 concurrency=DEFAULT_CONCURRENCY, throttle=None):
+
+        super(PooledHttpRequest, self).__init__(hostname, auth=auth)
+
+        self.session = ThrottledSession(
+            'transifex', throttle, pool_size=concurrency,
+        )
+
+    def _request(self, method, path, data=None, **kwargs):
+        """Perform a request on the shared session and return the response."""
+
+        url = self._construct_full_url(path)
+        _logger.debug("%s request for %s", method, url)
+        self._auth_info.populate_request_data(kwargs)
+
+        # Add custom headers for the request
+        if self._auth_info._headers:
+            kwargs.setdefault('headers', {}).update(self._auth_info._headers)
+
+        return self.session.request(method, url, data=data, **kwargs)
+
+    def get_response(self, path, headers=None, stream=False):
+        """Make a GET request and return the response.
+
+        Conditional requests may be made by passing headers such as
+        If-None-Match; a 304 Not Modified response is returned like a
+        successful one. With stream, the body is left to be read from
+        the response. Errors are raised as by get().
+        """
+
+        return self._checked_request(
+            'GET', path, headers=dict(headers or {}), stream=stream,
+        )
+
+    def _make_request(self, method, path, data=None, **kwargs):
+        """Make a request, returning the content or raising for errors."""
+
+        res = self._checked_request(method, path, data=data, **kwargs)
+
+        return res.content.decode('utf-8')
+
+    def _checked_request(self, method, path, data=None, **kwargs):
+
+        res = self._request(method, path, data=data, **kwargs)
+
+        if res.ok:
+            return res
+
+        if hasattr(res, 'content'):
+            _logger.debug("Response was %s:%s", res.status_code, res.content)
+            raise self._exception_for(res.status_code)(
+                res.content, http_code=res.status_code
+            )
+        else:
+            msg = "No response from URL: %s" % res.request.url
+            _logger.error(msg)
+            raise NoResponseError(msg)
@@ -0,0 +1,360 @@
+"""Run shuttle as a service that syncs single tutorials as they change.
+
+Desk (or anything else) POSTs to /articles/<id> when an article
+changes; the article is pushed to Transifex once its edits have
+settled. Pushed translations are polled for completion, and Transifex
+can also POST its translation webhook to /transifex; a translation is
+pulled to Desk as soon as it is complete. GET /status reports what is
+queued.
+
+    $ shuttle-daemon --locales fr_FR,de_DE --port 8000
+"""
+
+import BaseHTTPServer
+import collections
+import json
+import logging
+import signal
+import sys
+import threading
+import time
+import urlparse
+
+import metrics
+from metrics import default_request_log
+from plan import Plan
+from state import (
+    Journal,
+    StateStore,
+    TranslationCache,
+)
+from sync import (
+    DeskTutorials,
+    desk_client,
+    make_parser,
+)
+from throttle import default_throttle
+
+
+PUSH = 'push'
+PULL = 'pull'
+POLL = 'poll'
+
+DEFAULT_DEBOUNCE = 30
+DEFAULT_MAX_WAIT = 300
+DEFAULT_POLL_INTERVAL = 60
+
+
+class SyncDaemon(object):
+    """Sync single tutorials between Desk and Transifex as events arrive.
+
+    Events for the same article, or the same translation, are
+    coalesced: an event is processed once no other event for it has
+    arrived for debounce seconds, or max_wait seconds after the first,
+    whichever is sooner. The Desk and Tx clients, and their caches, are
+    kept from one event to the next.
+    """
+
+    def __init__(self, handler, log, debounce=DEFAULT_DEBOUNCE,
+                 max_wait=DEFAULT_MAX_WAIT, poll_interval=DEFAULT_POLL_INTERVAL):
+
+        self.handler = handler
+        self.log = log
+        self.debounce = debounce
+        self.max_wait = max_wait
+        self.poll_interval = poll_interval
+
+        options = handler.options
+        self.tx = handler.make_tx(cache=TranslationCache(options.cache_dir))
+        self.state = StateStore(options.state_file, read_only=handler.plan.dry_run)
+
+        self.condition = threading.Condition()
+        # event -> (first seen, due), for the events not processed yet
+        self.due = {}
+        # (slug, lang) pushed to Transifex and not yet complete
+        self.pending = set()
+        self.stats = collections.Counter()
+        self.stopping = False
+
+    def article_changed(self, article_id):
+        """Schedule the Desk article article_id to be pushed."""
+
+        self._schedule((PUSH, str(article_id)), self.debounce)
+
+    def translation_completed(self, slug, lang):
+        """Schedule the translation of slug in lang to be pulled."""
+
+        self._schedule((PULL, slug, lang), self.debounce)
+
+    def _schedule(self, event, delay):
+
+        now = time.time()
+        with self.condition:
+            first_seen, due = self.due.get(event, (now, None))
+            self.due[event] = (first_seen, min(now + delay, first_seen + self.max_wait))
+            self.condition.notify()
+
+    def _schedule_poll(self):
+
+        with self.condition:
+            if self.pending and POLL not in [event[0] for event in self.due]:
+                self._schedule((POLL, ), self.poll_interval)
+
+    def _next_due(self):
+        """Return the next event to fall due and when, or (None, None)."""
+
+        if not self.due:
+            return None, None
+
+        return min(
+            ((event, due) for event, (_, due) in self.due.items()),
+            key=lambda item: item[1],
+        )
+
+    def status(self):
+        """Return a dict describing the queued work and the events processed."""
+
+        with self.condition:
+            return dict(
+                queued=sorted(':'.join(event) for event in self.due),
+                pending=sorted('%s:%s' % item for item in self.pending),
+                processed=dict(self.stats),
+            )
+
+    def stop(self):
+        """Stop run() once the event being processed is finished."""
+
+        with self.condition:
+            self.stopping = True
+            self.condition.notify()
+
+    def run(self):
+        """Process events as they fall due, until stop() is called."""
+
+        while True:
+            with self.condition:
+                event = None
+                while not self.stopping:
+                    now = time.time()
+                    event, due = self._next_due()
+                    if event is not None and due <= now:
+                        break
+
+                    self.condition.wait(None if event is None else due - now)
+
+                if self.stopping:
+                    return
+
+                del self.due[event]
+
+            try:
+                getattr(self, '_%s' % (event[0], ))(*event[1:])
+                self.stats[event[0]] += 1
+            except Exception:
+                self.log.exception('Error processing %s.', ':'.join(event))
+                self.stats['errors'] += 1
+
+    def _push(self, article_id):
+
+        article = self.handler.desk.articles().by_id(article_id)
+        slug = article.api_href.rsplit('/', 1)[1]
+
+        with metrics.context(handler=self.handler.name):
+            try:
+                self.handler.push_article(self.tx, self.state, article)
+            finally:
+                self.state.save()
+
+        # wait for each translation that now has a resource
+        with self.condition:
+            for lang in self.handler.enabled_locales:
+                self.tx.forget_statistics(slug, lang)
+                if self.state.get(PUSH, '%s:%s' % (slug, lang)):
+                    self.pending.add((slug, lang))
+
+        self._schedule_poll()
+
+    def _poll(self):
+
+        with self.condition:
+            pending = sorted(self.pending)
+
+        for slug, lang in pending:
+            self.tx.forget_statistics(slug, lang)
+            if self.tx.translation_statistics(slug, lang) is None:
+                self.log.warning('Resource %s not found in %s; no longer waiting for it.',
+                                 slug, lang)
+                complete = True
+            else:
+                complete = self.handler.is_complete(self.tx, lang, slug)
+                if complete:
+                    self._schedule((PULL, slug, lang), 0)
+
+            if complete:
+                with self.condition:
+                    self.pending.discard((slug, lang))
+
+        self._schedule_poll()
+
+    def _pull(self, slug, lang):
+
+        # completion may have changed since the statistics were fetched
+        self.tx.forget_statistics(slug, lang)
+
+        with metrics.context(handler=self.handler.name):
+            # a fresh journal, so a translation is pulled each time it completes
+            failures = self.handler.pull_article(self.tx, Journal(), slug, [lang], self.log)
+
+        if failures:
+            raise RuntimeError('Failed pulling %s in %s: %s' % (slug, lang, failures[0][1]))
+
+        if self.handler.is_complete(self.tx, lang, slug):
+            with self.condition:
+                self.pending.discard((slug, lang))
+
+
+class _RequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def _respond(self, status, result):
+
+        body = json.dumps(result, sort_keys=True)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_fields(self):
+        """Return the fields of a JSON or form encoded request body."""
+
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if self.headers.get('Content-Type', '').startswith('application/json'):
+            return json.loads(body or '{}')
+
+        return dict(
+            (name, values[-1])
+            for name, values in urlparse.parse_qs(body).items()
+        )
+
+    def do_GET(self):
+
+        if self.path.rstrip('/') != '/status':
+            return self._respond(404, dict(error='not found'))
+
+        self._respond(200, self.server.daemon.status())
+
+    def do_POST(self):
+
+        path = urlparse.urlparse(self.path).path.strip('/').split('/')
+
+        if len(path) == 2 and path[0] == 'articles' and path[1].isdigit():
+            self.server.daemon.article_changed(path[1])
+            return self._respond(202, dict(scheduled=True))
+
+        if path == ['transifex']:
+            try:
+                fields = self._read_fields()
+                slug, lang = fields['resource'], fields['language']
+                percent = int(str(fields['percent']).rstrip('%'))
+            except (KeyError, TypeError, ValueError) as e:
+                return self._respond(400, dict(error='invalid webhook: %s' % (e, )))
+
+            # Transifex reports progress as well as completion
+            if percent == 100:
+                self.server.daemon.translation_completed(slug, lang)
+
+            return self._respond(202, dict(scheduled=percent == 100))
+
+        self._respond(404, dict(error='not found'))
+
+    def log_message(self, format, *args):
+
+        self.server.daemon.log.debug('%s - %s', self.address_string(), format % args)
+
+
+def parse_args(args=None):
+
+    parser = make_parser()
+    parser.set_usage('%prog --locales LOCALES [options]')
+    parser.add_option('--host', default='127.0.0.1',
+                      help="Address to listen on for events")
+    parser.add_option('--port', type='int', default=8000,
+                      help="Port to listen on for events")
+    parser.add_option(
+        '--debounce', type='float', default=DEFAULT_DEBOUNCE,
+        help="Seconds to wait for further edits before syncing an article",
+    )
+    parser.add_option(
+        '--max-wait', type='float', default=DEFAULT_MAX_WAIT,
+        help="Most seconds to delay syncing an article that keeps changing",
+    )
+    parser.add_option(
+        '--poll-interval', type='float', default=DEFAULT_POLL_INTERVAL,
+        help="Seconds between checks of pushed translations for completion",
+    )
+
+    options, args = parser.parse_args(args)
+    if not options.locales:
+        parser.error('--locales is required')
+
+    return options, args
+
+
+def main(args=None):
+    log = logging.getLogger()
+    log_handler = logging.StreamHandler()
+    log_handler.setFormatter(logging.Formatter('[%(threadName)s] %(message)s'))
+    log.addHandler(log_handler)
+    log.setLevel(logging.INFO)
+
+    options, args = parse_args(args)
+
+    default_throttle.configure(
+        rate=options.rate_limit,
+        concurrency=options.concurrency,
+        timeout=(options.connect_timeout, options.read_timeout),
+    )
+
+    plan = Plan(dry_run=options.plan)
+    handler = DeskTutorials(
+        log,
+        locales=[locale.strip() for locale in options.locales.split(',')],
+        options=options,
+        plan=plan,
+        desk=desk_client(options.concurrency),
+    )
+    daemon = SyncDaemon(
+        handler, log,
+        debounce=options.debounce,
+        max_wait=options.max_wait,
+        poll_interval=options.poll_interval,
+    )
+
+    server = BaseHTTPServer.HTTPServer((options.host, options.port), _RequestHandler)
+    server.daemon = daemon
+
+    worker = threading.Thread(target=daemon.run, name='sync')
+    worker.start()
+
+    # stop cleanly, finishing the event in progress, when terminated
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    log.info('Listening for events on %s:%d', options.host, options.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        daemon.stop()
+        worker.join()
+
+        if options.metrics_file:
+            default_request_log.write_summary(options.metrics_file)
+
+        default_throttle.report(log)
+        plan.report_avoided(log)
+
+
+if __name__ == '__main__':
+    main()
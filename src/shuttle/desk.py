@@ -0,0 +1,171 @@
+import re
+import threading
+
+from plan import (
+    CREATE,
+    UPDATE,
+)
+
+
+WHITESPACE = re.compile(r'\s+', re.UNICODE)
+
+
+def normalize(value):
+    """Return value with runs of whitespace collapsed, if it is a string."""
+
+    if isinstance(value, (bytes, type(u''))):
+        return WHITESPACE.sub(u' ', value).strip()
+
+    return value
+
+
+def unchanged(desk_object, fields):
+    """Return True if desk_object already has the values in fields.
+
+    Strings are compared with their whitespace normalized, so content
+    that was only reformatted does not count as a change.
+    """
+
+    for key, value in fields.items():
+        try:
+            if normalize(getattr(desk_object, key)) != normalize(value):
+                return False
+        except KeyError:
+            return False
+
+    return True
+
+
+class TopicSnapshot(object):
+    """Desk topics fetched once and shared by the handlers of a run.
+
+    Each topic's translations are loaded on first use and kept current
+    as they are written through write_translation.
+    """
+
+    def __init__(self, desk):
+
+        self.desk = desk
+        self._topics = None
+        self._translations = {}
+        self._lock = threading.Lock()
+
+    def topics(self):
+        """Return the list of Desk topics."""
+
+        with self._lock:
+            if self._topics is None:
+                self._topics = list(self.desk.topics())
+
+            return self._topics
+
+    def translations(self, topic):
+        """Return a dict of the translations of topic, by locale."""
+
+        if topic.api_href not in self._translations:
+            self._translations[topic.api_href] = dict(
+                topic.translations.items()
+            )
+
+        return self._translations[topic.api_href]
+
+    def write_translation(self, plan, topic, locale, **fields):
+        """Create or update the translation of topic for locale.
+
+        The write is made through plan (a HandlerPlan). Nothing is
+        written if the translation already has these field values.
+        Returns False if the translation was already up to date.
+        """
+
+        translations = self.translations(topic)
+        existing = translations.get(locale)
+        target = 'topic %s' % (topic.name, )
+
+        if existing is None:
+            translation = plan.write(
+                'desk', locale, CREATE, target,
+                topic.translations.create, locale=locale, **fields
+            )
+        elif unchanged(existing, fields):
+            plan.unchanged('desk', locale, target)
+            return False
+        else:
+            translation = plan.write(
+                'desk', locale, UPDATE, target,
+                existing.update, **fields
+            )
+
+        if translation is not None:
+            translations[locale] = translation
+
+        return True
+
+
+class ArticleScan(object):
+    """The Desk articles updated since a high-water mark.
+
+    Iterating yields the articles updated at or after since, most
+    recently updated first, reading only as many pages of the listing
+    as that takes; if the listing turns out not to be sorted, the rest
+    of it is read. With no since every article is yielded. Pages are
+    read as they are needed, and not kept. The latest updated_at seen
+    is kept as watermark, to pass as since to the next scan once this
+    one has been processed.
+    """
+
+    PER_PAGE = 100
+
+    def __init__(self, desk, since=None):
+
+        self.desk = desk
+        self.since = since
+        self.watermark = since
+
+    def __iter__(self):
+
+        for article in self._iter_articles():
+            try:
+                updated_at = article.updated_at
+            except KeyError:
+                updated_at = None
+
+            if updated_at and (self.watermark is None or updated_at > self.watermark):
+                self.watermark = updated_at
+
+            yield article
+
+    def _iter_articles(self):
+
+        if self.since is None:
+            path = 'articles?per_page=%d' % (self.PER_PAGE, )
+        else:
+            path = 'articles?sort_field=updated_at&sort_direction=desc&per_page=%d' % (
+                self.PER_PAGE,
+            )
+
+        # the listing is trusted to be sorted until an entry shows it isn't
+        sorted_desc = True
+        previous = None
+
+        while path:
+            page = self.desk.request(path).json()
+
+            for entry in page.get('_embedded', {}).get('entries', []):
+                # Desk timestamps are ISO 8601 in UTC, so sort as strings;
+                # an entry without one is processed, not taken as the end
+                updated_at = entry.get('updated_at')
+
+                if updated_at is not None:
+                    if previous is not None and updated_at > previous:
+                        sorted_desc = False
+                    previous = updated_at
+
+                    if self.since is not None and updated_at < self.since:
+                        if sorted_desc:
+                            return
+                        continue
+
+                yield self.desk.object(entry)
+
+            # the last page links to a null next page
+            path = ((page.get('_links') or {}).get('next') or {}).get('href')
@@ -0,0 +1,143 @@
+import collections
+import contextlib
+import json
+import threading
+
+try:
+    from urlparse import urlparse
+except ImportError:
+    from urllib.parse import urlparse
+
+
+_context = threading.local()
+
+
+def current_context():
+    """Return the metrics context (handler, locale) of this thread."""
+
+    return dict(getattr(_context, 'values', {}))
+
+
+@contextlib.contextmanager
+def context(**values):
+    """Attribute requests made in this block to the given handler/locale."""
+
+    previous = getattr(_context, 'values', {})
+    _context.values = dict(previous, **values)
+
+    try:
+        yield
+    finally:
+        _context.values = previous
+
+
+def endpoint_category(service, url):
+    """Return a category for url with the identifiers stripped out.
+
+    Both APIs alternate collection names and identifiers in their
+    paths, so /api/2/project/<slug>/resource/<slug>/stats/ becomes
+    "transifex project/resource/stats".
+    """
+
+    segments = [s for s in urlparse(url).path.split('/') if s]
+    if segments[:2] in (['api', '2'], ['api', 'v2']):
+        segments = segments[2:]
+
+    return '%s %s' % (service, '/'.join(segments[::2]))
+
+
+def percentile(ordered, fraction):
+
+    if not ordered:
+        return None
+
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+class RequestLog(object):
+    """Record the HTTP requests made to each service.
+
+    Every request is counted by service, and by the handler, locale and
+    endpoint category it belongs to, with its latency, status and the
+    number of bytes sent and received.
+    """
+
+    def __init__(self):
+
+        self.requests = collections.Counter()
+        self.seconds = collections.Counter()
+        self._groups = {}
+        self._lock = threading.Lock()
+
+    def record(self, service, method, seconds, url=None, status=None,
+               bytes_sent=0, bytes_received=0):
+
+        request_context = current_context()
+        groups = (
+            ('service', service),
+            ('handler', request_context.get('handler')),
+            ('locale', request_context.get('locale')),
+            ('endpoint', endpoint_category(service, url) if url else None),
+        )
+
+        with self._lock:
+            self.requests[service] += 1
+            self.seconds[service] += seconds
+
+            for group, name in groups:
+                stats = self._groups.setdefault(group, {}).setdefault(
+                    str(name), {
+                        'latencies': [],
+                        'statuses': collections.Counter(),
+                        'bytes_sent': 0,
+                        'bytes_received': 0,
+                    },
+                )
+                stats['latencies'].append(seconds)
+                stats['statuses'][str(status)] += 1
+                stats['bytes_sent'] += bytes_sent
+                stats['bytes_received'] += bytes_received
+
+    def mean_latency(self, service):
+        """Return the mean request latency for service, or None."""
+
+        with self._lock:
+            if not self.requests[service]:
+                return None
+
+            return self.seconds[service] / self.requests[service]
+
+    def summary(self):
+        """Return the recorded requests summarized as a dict.
+
+        For each grouping (service, handler, locale, endpoint) and name
+        the summary holds the request count, statuses, bytes and the
+        p50/p95/p99 latencies in seconds.
+        """
+
+        result = {}
+
+        with self._lock:
+            for group, names in self._groups.items():
+                for name, stats in names.items():
+                    latencies = sorted(stats['latencies'])
+                    result.setdefault(group, {})[name] = {
+                        'requests': len(latencies),
+                        'seconds': sum(latencies),
+                        'statuses': dict(stats['statuses']),
+                        'bytes_sent': stats['bytes_sent'],
+                        'bytes_received': stats['bytes_received'],
+                        'p50': percentile(latencies, 0.50),
+                        'p95': percentile(latencies, 0.95),
+                        'p99': percentile(latencies, 0.99),
+                    }
+
+        return result
+
+    def write_summary(self, path):
+
+        with open(path, 'w') as summary_file:
+            json.dump(self.summary(), summary_file, indent=2, sort_keys=True)
+
+
+default_request_log = RequestLog()
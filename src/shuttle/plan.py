@@ -0,0 +1,131 @@
+import collections
+import threading
+
+from metrics import default_request_log
+
+
+CREATE = 'create'
+UPDATE = 'update'
+SKIP = 'skip'
+
+
+class Plan(object):
+    """Tally of the writes a sync run makes, or would make.
+
+    Writes are counted by handler, locale, action and service. In dry
+    run mode the writes are recorded instead of performed, and every
+    target is kept so the full plan can be reported.
+    """
+
+    def __init__(self, dry_run=False, request_log=None):
+
+        self.dry_run = dry_run
+        self.request_log = request_log or default_request_log
+        self.counts = collections.Counter()
+        # writes skipped because the target already had the content,
+        # by (handler, service)
+        self.avoided = collections.Counter()
+        self.targets = collections.defaultdict(list)
+        self._lock = threading.Lock()
+
+    def handler(self, name):
+        """Return a HandlerPlan recording into this plan as name."""
+
+        return HandlerPlan(self, name)
+
+    def record(self, handler, service, locale, action, target):
+
+        with self._lock:
+            self.counts[(handler, locale, action, service)] += 1
+            if self.dry_run:
+                self.targets[(handler, locale)].append((action, target))
+
+    def record_unchanged(self, handler, service, locale, target):
+        """Record a write avoided because target is already up to date."""
+
+        self.record(handler, service, locale, SKIP, target)
+
+        with self._lock:
+            self.avoided[(handler, service)] += 1
+
+    def report_avoided(self, log):
+        """Log the number of writes avoided because nothing had changed."""
+
+        for (handler, service), count in sorted(self.avoided.items(), key=str):
+            log.info('%s: %d %s writes avoided, content unchanged.',
+                     handler, count, service)
+
+    def report(self, stream, workers=1):
+        """Write the planned and skipped actions, and a time estimate, to stream."""
+
+        by_locale = collections.defaultdict(collections.Counter)
+        writes = collections.Counter()
+        for (handler, locale, action, service), count in self.counts.items():
+            by_locale[(handler, locale)][action] += count
+            if action != SKIP:
+                writes[service] += count
+
+        for handler, locale in sorted(by_locale, key=str):
+            counts = by_locale[(handler, locale)]
+            stream.write('%s %s: %d create, %d update, %d skip\n' % (
+                handler, locale, counts[CREATE], counts[UPDATE], counts[SKIP],
+            ))
+            # the targets to be written, then those left alone
+            targets = self.targets.get((handler, locale), ())
+            for action, target in sorted(targets, key=lambda item: item[0] == SKIP):
+                stream.write('    %s %s\n' % (action, target))
+
+        # assume writes take as long as the requests observed so far
+        seconds = sum(self.request_log.seconds.values())
+        for service in sorted(set(self.request_log.requests) | set(writes)):
+            latency = self.request_log.mean_latency(service)
+            stream.write(
+                '%s: %d requests made, %d writes planned, %s mean latency\n' % (
+                    service,
+                    self.request_log.requests[service],
+                    writes[service],
+                    '%.3fs' % latency if latency is not None else 'unknown',
+                )
+            )
+            seconds += writes[service] * (latency or 0)
+
+        stream.write('Estimated time: %.1fs serial, %.1fs with %d workers\n' % (
+            seconds, seconds / max(workers, 1), max(workers, 1),
+        ))
+
+
+class HandlerPlan(object):
+    """The view of a Plan used by one sync handler."""
+
+    def __init__(self, plan, name):
+
+        self.plan = plan
+        self.name = name
+
+    @property
+    def dry_run(self):
+
+        return self.plan.dry_run
+
+    def write(self, service, locale, action, target, func, *args, **kwargs):
+        """Record a write and perform it by calling func, unless dry run.
+
+        Returns the result of func, or None in dry run mode.
+        """
+
+        self.plan.record(self.name, service, locale, action, target)
+
+        if self.plan.dry_run:
+            return None
+
+        return func(*args, **kwargs)
+
+    def skip(self, service, locale, target):
+        """Record that target was left alone, for example as incomplete."""
+
+        self.plan.record(self.name, service, locale, SKIP, target)
+
+    def unchanged(self, service, locale, target):
+        """Record that writing target was avoided as it is up to date."""
+
+        self.plan.record_unchanged(self.name, service, locale, target)
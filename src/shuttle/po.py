@@ -0,0 +1,87 @@
+from babel.messages.pofile import (
+    escape,
+    unescape,
+)
+
+
+PO_HEADER = u'''msgid ""
+msgstr ""
+"MIME-Version: 1.0\\n"
+"Content-Type: text/plain; charset=utf-8\\n"
+"Content-Transfer-Encoding: 8bit\\n"
+
+'''
+
+
+def iter_po(messages):
+    """Yield the pieces of a PO template containing messages.
+
+    Duplicate messages are only written once. Joining the pieces gives
+    the complete document without building a babel Catalog first.
+    """
+
+    yield PO_HEADER
+
+    seen = set()
+    for message in messages:
+        if message in seen:
+            continue
+        seen.add(message)
+
+        yield u'msgid %s\nmsgstr ""\n\n' % (escape(message), )
+
+
+def _iter_lines(content):
+
+    start = 0
+    while start < len(content):
+        end = content.find(u'\n', start)
+        if end == -1:
+            end = len(content)
+
+        yield content[start:end].strip()
+        start = end + 1
+
+
+def read_translations(content):
+    """Return a dict mapping msgid to translated string for a PO document.
+
+    Comments, obsolete messages, the header and untranslated messages
+    are skipped; for plural messages the first form is used. Unlike
+    babel's read_po no Catalog is built, only the flat mapping.
+    """
+
+    translations = {}
+    fields = {}
+    field = None
+
+    def finish():
+        msgid = fields.get('msgid')
+        msgstr = fields.get('msgstr', fields.get('msgstr[0]'))
+        if msgid and msgstr:
+            translations[msgid] = msgstr
+        fields.clear()
+
+    for line in _iter_lines(content):
+
+        if not line or line.startswith(u'#'):
+            if any(k.startswith('msgstr') for k in fields):
+                finish()
+            continue
+
+        if line.startswith(u'"'):
+            if field is not None:
+                fields[field] += unescape(line)
+            continue
+
+        keyword, _, value = line.partition(u' ')
+        if keyword in ('msgid', 'msgctxt') and any(
+                k.startswith('msgstr') for k in fields):
+            finish()
+
+        field = str(keyword)
+        fields[field] = unescape(value.strip())
+
+    finish()
+
+    return translations
@@ -0,0 +1,164 @@
+import collections
+import contextlib
+import cProfile
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+
+
+# seconds between samples of the running stacks
+SAMPLE_INTERVAL = 0.005
+
+
+def _cpu_time():
+    """Return the user and system CPU time of this process."""
+
+    return sum(os.times()[:2])
+
+
+def _frame_label(frame):
+
+    code = frame.f_code
+    return '%s (%s:%d)' % (
+        code.co_name, os.path.basename(code.co_filename), code.co_firstlineno,
+    )
+
+
+class StackSampler(object):
+    """Count the stacks of every thread, sampled every interval seconds.
+
+    Threads waiting on the network are sampled as well as those
+    running Python code, so the counts show where wall time goes.
+    Stacks are kept collapsed, root first, as flamegraph.pl reads them.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+
+        self._thread = threading.Thread(target=self._run, name='profile-sampler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+
+        sampler = threading.current_thread().ident
+
+        while not self._stopped.wait(self.interval):
+            names = dict((t.ident, t.name) for t in threading.enumerate())
+
+            for ident, frame in sys._current_frames().items():
+                if ident == sampler:
+                    continue
+
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+
+                stack.append(names.get(ident, 'thread-%s' % (ident, )))
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def write(self, path):
+        """Write the collapsed stacks to path, one per line with its count."""
+
+        with open(path, 'w') as stacks_file:
+            for stack, count in sorted(self.stacks.items()):
+                stacks_file.write('%s %d\n' % (stack, count))
+
+
+class Profiler(object):
+    """Profile the push and pull of each handler into a directory.
+
+    For each handler and action a cProfile of every thread involved is
+    written to <handler>-<action>.pstats, and sampled stacks to
+    <handler>-<action>.collapsed. The wall and CPU time of each are
+    logged and written to summary.json. CPU time is measured for the
+    whole process, so handlers should run one at a time. With no
+    directory nothing is profiled.
+    """
+
+    def __init__(self, directory=None, log=None):
+
+        self.directory = directory
+        self.log = log
+        self.results = []
+
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    @contextlib.contextmanager
+    def profile(self, handler, action):
+
+        if not self.directory:
+            yield
+            return
+
+        profiles = [cProfile.Profile()]
+        lock = threading.Lock()
+
+        def profile_thread(frame, event, arg):
+            # called once in each new thread; profile it from here on
+            sys.setprofile(None)
+            profile = cProfile.Profile()
+            with lock:
+                profiles.append(profile)
+            profile.enable()
+
+        sampler = StackSampler()
+        sampler.start()
+        threading.setprofile(profile_thread)
+
+        start_wall, start_cpu = time.time(), _cpu_time()
+        profiles[0].enable()
+        try:
+            yield
+        finally:
+            profiles[0].disable()
+            wall, cpu = time.time() - start_wall, _cpu_time() - start_cpu
+            threading.setprofile(None)
+            sampler.stop()
+
+            self._write(handler, action, wall, cpu, profiles, sampler)
+
+    def _write(self, handler, action, wall, cpu, profiles, sampler):
+
+        path = os.path.join(self.directory, '%s-%s' % (handler, action))
+
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        stats.dump_stats('%s.pstats' % (path, ))
+        sampler.write('%s.collapsed' % (path, ))
+
+        self.results.append(dict(
+            handler=handler, action=action, wall=wall, cpu=cpu,
+            threads=len(profiles),
+        ))
+        self.log.info(
+            '%s %s: %.2fs wall, %.2fs CPU (%d%%), %d thread(s); profile in %s.pstats',
+            handler, action, wall, cpu, 100 * cpu / wall if wall else 0,
+            len(profiles), path,
+        )
+
+    def write_summary(self):
+        """Write the wall and CPU times of everything profiled to summary.json."""
+
+        if not self.directory:
+            return
+
+        with open(os.path.join(self.directory, 'summary.json'), 'w') as summary_file:
+            json.dump(self.results, summary_file, indent=2, sort_keys=True)
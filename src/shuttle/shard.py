@@ -0,0 +1,140 @@
+import errno
+import hashlib
+import os
+import socket
+import threading
+import time
+
+
+# a lease older than this belongs to a process that died holding it
+DEFAULT_LEASE_TTL = 300
+
+
+class Shard(object):
+    """One of count slices of the work of a sync run, numbered from 1.
+
+    Work is assigned to shards by a stable hash of its key, such as a
+    Desk article ID or a locale, so every process of a sharded run
+    agrees on which of them owns each item without talking to the
+    others.
+    """
+
+    def __init__(self, index=1, count=1):
+
+        if not 1 <= index <= count:
+            raise ValueError('Shard %d is not between 1 and %d' % (index, count))
+
+        self.index = index
+        self.count = count
+
+    @classmethod
+    def parse(cls, value):
+        """Return the Shard described by value, as K/N."""
+
+        try:
+            index, count = [int(part) for part in value.split('/')]
+        except ValueError:
+            raise ValueError('Shards are given as K/N, not %r' % (value, ))
+
+        return cls(index, count)
+
+    def owns(self, key):
+        """Return True if the item identified by key belongs to this shard."""
+
+        if self.count == 1:
+            return True
+
+        digest = hashlib.md5((u'%s' % (key, )).encode('utf-8')).hexdigest()
+        return int(digest[:8], 16) % self.count == self.index - 1
+
+    def __str__(self):
+
+        return '%d/%d' % (self.index, self.count)
+
+
+class Lease(object):
+    """Exclusive lease on name, shared by processes through a directory.
+
+    The lease is a file created with O_EXCL, so the directory may be
+    shared by the hosts of a sharded run. While it exists other
+    processes wait for it; one older than ttl seconds is broken, by
+    renaming it out of the way so only one process can break it. With
+    no directory the lease is always granted at once.
+    """
+
+    def __init__(self, directory, name, ttl=DEFAULT_LEASE_TTL, poll_interval=0.5):
+
+        self.path = directory and os.path.join(directory, '%s.lease' % (name, ))
+        self.ttl = ttl
+        self.poll_interval = poll_interval
+
+    def __enter__(self):
+
+        while self.path:
+            try:
+                fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+                if self._expired(self.path):
+                    self._break()
+                else:
+                    time.sleep(self.poll_interval)
+
+                continue
+
+            # record the holder, for whoever finds the lease left behind
+            os.write(fd, '%s %d\n' % (socket.gethostname(), os.getpid()))
+            os.close(fd)
+            break
+
+        return self
+
+    def __exit__(self, *exc_info):
+
+        if self.path:
+            self._release()
+
+    def _expired(self, path):
+
+        try:
+            return time.time() - os.path.getmtime(path) > self.ttl
+        except OSError:
+            # released since we tried to take it
+            return False
+
+    def _break(self):
+        """Remove an expired lease, unless another process got there first."""
+
+        broken = '%s.%s.%d.%d.broken' % (
+            self.path, socket.gethostname(), os.getpid(), threading.current_thread().ident,
+        )
+
+        # only one process can rename the lease; the others find it gone
+        # and race to take it with O_EXCL
+        try:
+            os.rename(self.path, broken)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return
+
+        # if the lease was broken and taken afresh after we saw it
+        # expire, we renamed the new one; put it back unless it is taken
+        if not self._expired(broken):
+            try:
+                os.link(broken, self.path)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+        os.remove(broken)
+
+    def _release(self):
+
+        try:
+            os.remove(self.path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
@@ -0,0 +1,173 @@
+import hashlib
+import json
+import os
+import threading
+
+
+def content_hash(content):
+    """Return a stable hex digest for a (unicode or byte) string."""
+
+    if not isinstance(content, bytes):
+        content = content.encode('utf-8')
+
+    return hashlib.sha1(content).hexdigest()
+
+
+class StateStore(object):
+    """Local record of what previous runs synced, persisted as JSON.
+
+    Values are grouped into named sections (for example ``push``) and
+    keyed by strings. If path is None the store is kept in memory only,
+    so callers can use it unconditionally. A read_only store is loaded
+    from path but never written back.
+    """
+
+    def __init__(self, path=None, read_only=False):
+
+        self.path = path
+        self.read_only = read_only
+        self._lock = threading.Lock()
+        self._data = {}
+
+        if path and os.path.exists(path):
+            with open(path) as state_file:
+                self._data = json.load(state_file)
+
+    def get(self, section, key, default=None):
+
+        with self._lock:
+            return self._data.get(section, {}).get(key, default)
+
+    def set(self, section, key, value):
+
+        with self._lock:
+            self._data.setdefault(section, {})[key] = value
+
+    def save(self):
+        """Write the store to disk, replacing the previous file atomically."""
+
+        if not self.path or self.read_only:
+            return
+
+        with self._lock:
+            tmp_path = '%s.tmp' % (self.path, )
+            with open(tmp_path, 'w') as state_file:
+                json.dump(self._data, state_file, sort_keys=True)
+
+            os.rename(tmp_path, self.path)
+
+
+class Journal(object):
+    """Append-only checkpoint of the items a run has completed.
+
+    Each completed item is appended to path as a line of JSON and
+    flushed to disk immediately, so a run that dies part way leaves a
+    record of everything it applied. Entries are grouped into sections
+    and keyed by strings, as in StateStore.
+
+    Unless resume is True an existing journal is discarded, so get()
+    only reports items from an interrupted earlier run when resuming.
+    If path is None nothing is written; a read_only journal is loaded
+    but never written.
+    """
+
+    def __init__(self, path=None, resume=False, read_only=False):
+
+        self.path = path
+        self.read_only = read_only
+        self._lock = threading.Lock()
+        self._data = {}
+        self._file = None
+
+        if path and resume and os.path.exists(path):
+            with open(path) as journal_file:
+                for line in journal_file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # the last line may be cut short by a crash
+                        continue
+
+                    self._data.setdefault(entry['section'], {})[entry['key']] = entry['value']
+
+        if path and not read_only:
+            self._file = open(path, 'a' if resume else 'w')
+
+    def get(self, section, key, default=None):
+
+        with self._lock:
+            return self._data.get(section, {}).get(key, default)
+
+    def record(self, section, key, value):
+        """Record that key was completed, writing it through to disk."""
+
+        with self._lock:
+            self._data.setdefault(section, {})[key] = value
+
+            if self._file is not None:
+                self._file.write(json.dumps(dict(
+                    section=section, key=key, value=value,
+                ), sort_keys=True) + '\n')
+                self._file.flush()
+                os.fsync(self._file.fileno())
+
+    def close(self, completed=False):
+        """Close the journal; a completed run's journal is removed."""
+
+        with self._lock:
+            if self._file is None:
+                return
+
+            self._file.close()
+            self._file = None
+
+            if completed:
+                os.remove(self.path)
+
+
+class TranslationCache(object):
+    """On-disk cache of downloaded translations and their validators.
+
+    Entries are dicts (for example content, etag and last_update) keyed
+    by a tuple such as (project, slug, lang); each is stored as a JSON
+    file in directory. If directory is None nothing is cached, so
+    callers can use the cache unconditionally.
+    """
+
+    def __init__(self, directory=None):
+
+        self.directory = directory
+
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _path(self, key):
+
+        return os.path.join(
+            self.directory,
+            '%s.json' % (content_hash(u'\0'.join(key)), ),
+        )
+
+    def get(self, key):
+
+        if not self.directory:
+            return None
+
+        try:
+            with open(self._path(key)) as cache_file:
+                return json.load(cache_file)
+        except (IOError, ValueError):
+            return None
+
+    def set(self, key, value):
+
+        if not self.directory:
+            return
+
+        # write to a file of our own, then replace the entry atomically
+        path = self._path(key)
+        tmp_path = '%s.%s.tmp' % (path, threading.current_thread().ident)
+        with open(tmp_path, 'w') as cache_file:
+            json.dump(value, cache_file)
+
+        os.rename(tmp_path, path)
@@ -1,16 +1,44 @@
+import collections
 import optparse
 import logging
-from cStringIO import StringIO
-
-import babel.messages.catalog
-import babel.messages.pofile
-from deskapi.models import DeskApi2
-from django.conf import settings
-import txlib_too.api.statistics
-import txlib_too.api.translations
-from txlib_too.http.exceptions import NotFoundError
-
-from transifex import Tx
+import sys
+import threading
+import time
+
+# deskapi, django, txlib_too and babel (through po) are slow to import;
+# they are imported where they are first needed, so that --help and
+# handlers that don't use them start quickly
+import codec
+from desk import (
+    ArticleScan,
+    TopicSnapshot,
+    unchanged,
+)
+import metrics
+from metrics import default_request_log
+from plan import (
+    CREATE,
+    Plan,
+    UPDATE,
+)
+from profiling import Profiler
+from shard import Shard
+from state import (
+    content_hash,
+    Journal,
+    StateStore,
+    TranslationCache,
+)
+from throttle import (
+    DEFAULT_CONCURRENCY,
+    DEFAULT_RATE,
+    DEFAULT_TIMEOUT,
+    default_throttle,
+)
+from workers import (
+    Pipeline,
+    WorkerPool,
+)
 
 
 DEFAULT_VENDOR_LOCALE_MAP = {'en_us': 'en'}
@@ -18,11 +46,24 @@ DEFAULT_VENDOR_LOCALE_MAP = {'en_us': 'en'}
 DEFAULT_SOURCE_LANGUAGE = 'en_US'
 DEFAULT_I18N_TYPE = 'HTML'
 
+# the StateStore section of the updated-since marks of article scans
+WATERMARK = 'watermark'
+# the StateStore section of the Tx locale summaries of the last pull, by project
+LOCALE_SUMMARY = 'locale_summary'
+# the StateStore section of when each project was last pulled in full
+LOCALE_PULLED = 'locale_pulled'
+
+DEFAULT_FULL_PULL_INTERVAL = 24
+
 
 class DeskTxSync(object):
 
+    # the name of this handler in HANDLERS
+    name = None
+
     def __init__(self, tx_project_slug, log, locales=None,
-                 vendor_locale_map=None, options=None):
+                 vendor_locale_map=None, options=None, topics=None,
+                 plan=None, desk=None):
 
         self.tx_project_slug = tx_project_slug
         self.log = log
@@ -34,10 +75,24 @@ class DeskTxSync(object):
             ((v, k) for k, v in self.vendor_locale_map.iteritems())
         )
 
-        self.desk = DeskApi2(
-            sitename=settings.DESK_SITENAME,
-            auth=(settings.DESK_USER, settings.DESK_PASSWD),
-        )
+        # the Desk client and topics may be shared with the other
+        # handlers of this run
+        self.desk = desk or desk_client()
+        self.topics = topics or TopicSnapshot(self.desk)
+
+        # writes go through the plan, which skips them in dry runs
+        self.plan = (plan or Plan()).handler(self.name)
+
+        # the slice of the articles and locales this process syncs
+        self.shard = self.options.shard
+
+    def make_tx(self, cache=None):
+        """Return a Tx client for this handler's Transifex project."""
+
+        from transifex import Tx
+
+        return Tx(self.tx_project_slug, concurrency=self.options.concurrency,
+                  plan=self.plan, cache=cache, lease_dir=self.options.lease_dir)
 
     def _process_locale(self, locale):
         """Return True if this locale should be processed."""
@@ -52,6 +107,34 @@ class DeskTxSync(object):
             self.reverse_locale_map.get(locale.lower(), None) in self.lower_locales
         )
 
+    def scan_articles(self, state, action):
+        """Return an ArticleScan of the articles to consider for action.
+
+        Only articles updated since the last complete scan for action,
+        with the same locales, are listed; --full-scan and --force list
+        them all.
+        """
+
+        since = None
+        if not (self.options.full_scan or self.options.force):
+            since = state.get(WATERMARK, self._watermark_key(action))
+
+        if since:
+            self.log.info('Scanning articles updated since %s.', since)
+
+        return ArticleScan(self.desk, since)
+
+    def save_watermark(self, state, action, scan):
+        """Record that the articles of scan have been processed for action."""
+
+        if scan.watermark:
+            state.set(WATERMARK, self._watermark_key(action), scan.watermark)
+
+    def _watermark_key(self, action):
+
+        # a newly enabled locale needs every article
+        return '%s:%s:%s' % (self.name, action, ','.join(sorted(self.enabled_locales)))
+
     def desk_locale(self, locale):
         """Return the Desk-style locale for locale."""
 
@@ -84,19 +167,23 @@ class DeskEnglishTxSync(DeskTxSync):
 
 class DeskEnglishTopics(DeskEnglishTxSync):
 
+    name = 'english_topics'
+
     def push(self):
 
         self.log.info("Refusing to Push topics for English locales.")
 
     def pull(self):
 
-        for topic in self.desk.topics():
+        up_to_date = 0
+
+        for topic in self.topics.topics():
 
             if topic.in_support_center:
 
                 for locale in self.enabled_locales:
 
-                    if not self._process_locale(locale):
+                    if not self._process_locale(locale) or not self.shard.owns(locale):
                         continue
 
                     self.log.info(
@@ -112,43 +199,47 @@ class DeskEnglishTopics(DeskEnglishTxSync):
                         in_support_center=True,
                     )
 
-                    if locale not in topic.translations:
-                        success = topic.translations.create(
-                            locale=locale,
-                            **locale_kwargs
-                        )
-                    else:
-                        success = topic.translations[locale].update(
-                            **locale_kwargs
+                    with metrics.context(locale=locale):
+                        written = self.topics.write_translation(
+                            self.plan, topic, locale, **locale_kwargs
                         )
 
-                    if not success:
-                        self.log.error(
-                            'Error updating topic %s (%s)',
-                            topic.name,
-                            topic.api_href,
-                        )
+                    if not written:
+                        self.log.debug('Topic %s unchanged for %s.',
+                                       topic.name, locale)
+                        up_to_date += 1
+
+        self.log.info('%d topic translations already up to date.', up_to_date)
 
 
 class DeskEnglishTutorials(DeskEnglishTxSync):
 
+    name = 'english_tutorials'
+
     def push(self):
 
         self.log.info("Refusing to Push tutorials for English locales.")
 
     def pull(self):
 
+        state = StateStore(self.options.state_file, read_only=self.plan.dry_run)
+
+        scan = None
         if self.options.resources:
             articles = [
                 self.desk.articles().by_id(r.strip())
                 for r in self.options.resources.split(',')
             ]
         else:
-            articles = self.desk.articles()
+            articles = scan = self.scan_articles(state, 'pull')
 
+        failed = False
         for a in articles:
 
-            for translation in a.translations:
+            if not self.shard.owns(a.api_href.rsplit('/', 1)[1]):
+                continue
+
+            for translation in a.translations.items().values():
 
                 if not self._process_locale(translation.locale):
                     self.log.debug('Skipping locale %s.', translation.locale)
@@ -156,29 +247,60 @@ class DeskEnglishTutorials(DeskEnglishTxSync):
 
                 if (self.options.force or translation.out_of_date):
 
+                    if (
+                        not self.options.force and
+                        unchanged(translation, dict(subject=a.subject, body=a.body))
+                    ):
+                        # the content is current, but only an update
+                        # clears the flag
+                        self.log.debug('Article %s unchanged for %s; clearing out of date.',
+                                       a.id, translation.locale)
+                        with metrics.context(locale=translation.locale):
+                            self.plan.write(
+                                'desk', translation.locale, UPDATE,
+                                'article %s' % (a.id, ),
+                                translation.update,
+                                out_of_date=False,
+                            )
+                        continue
+
                     self.log.info(
                         'Preparing to push %s for %s',
                         a.id,
                         translation.locale,
                     )
 
-                    success = translation.update(
-                        subject=a.subject,
-                        body=a.body,
-                    )
+                    with metrics.context(locale=translation.locale):
+                        success = self.plan.write(
+                            'desk', translation.locale, UPDATE,
+                            'article %s' % (a.id, ),
+                            translation.update,
+                            subject=a.subject,
+                            body=a.body,
+                        )
 
-                    if not success:
+                    if not success and not self.plan.dry_run:
                         self.log.error(
                             'Error updating %s (desk ID %s).',
-                            translation.locales,
+                            translation.locale,
                             a.id,
                         )
+                        failed = True
+
+        # rescan from the same mark if anything is left to update
+        if scan is not None and not failed:
+            self.save_watermark(state, 'pull', scan)
+            state.save()
 
 
 class DeskTopics(DeskTxSync):
 
+    name = 'topics'
+
     def __init__(self, *args, **kwargs):
 
+        from django.conf import settings
+
         super(DeskTopics, self).__init__(settings.TOPICS_PROJECT_SLUG,
                                          *args, **kwargs)
 
@@ -187,95 +309,120 @@ class DeskTopics(DeskTxSync):
     def push(self):
         """Push topics to Transifex."""
 
-        tx = Tx(self.tx_project_slug)
-
-        # asssemble the template catalog
-        template = babel.messages.catalog.Catalog()
-        for topic in self.desk.topics():
-            if topic.show_in_portal:
-                template.add(topic.name)
-
-        # serialize the catalog as a PO file
-        template_po = StringIO()
-        babel.messages.pofile.write_po(template_po, template)
-
-        # upload/update the catalog resource
-        tx.create_or_update_resource(
-            self.TOPIC_STRINGS_SLUG,
-            DEFAULT_SOURCE_LANGUAGE,
-            "Help Center Topics",
-            template_po.getvalue(),
-            i18n_type='PO',
-            project_slug=self.tx_project_slug,
-        )
+        import po
+
+        # the catalog is shared by every locale, so one shard uploads it
+        if not self.shard.owns(self.TOPIC_STRINGS_SLUG):
+            self.log.info('Topics are pushed by another shard.')
+            return
+
+        tx = self.make_tx()
+
+        # serialize the topic names as a PO template
+        template_po = u''.join(po.iter_po(
+            topic.name for topic in self.topics.topics()
+            if topic.show_in_portal
+        ))
+
+        # upload/update the catalog resource, keeping out any other run
+        # doing the same
+        with tx.lease(self.TOPIC_STRINGS_SLUG):
+            tx.create_or_update_resource(
+                self.TOPIC_STRINGS_SLUG,
+                DEFAULT_SOURCE_LANGUAGE,
+                "Help Center Topics",
+                template_po,
+                i18n_type='PO',
+                project_slug=self.tx_project_slug,
+            )
 
     def pull(self):
         """Pull topics from Transifex."""
 
-        topic_stats = txlib_too.api.statistics.Statistics.get(
+        tx = self.make_tx(cache=TranslationCache(self.options.cache_dir))
+
+        topic_stats = tx.resource_statistics(
+            self.TOPIC_STRINGS_SLUG,
+            None,
             project_slug=self.tx_project_slug,
-            resource_slug=self.TOPIC_STRINGS_SLUG,
         )
 
-        translated = {}
-
         # for each language
         for locale in self.enabled_locales:
 
-            if not self._process_locale(locale):
+            if not self._process_locale(locale) or not self.shard.owns(locale):
                 continue
 
-            locale_stats = getattr(topic_stats, locale, None)
-            if locale_stats is None:
-                self.log.debug('Locale %s not present when pulling topics.' %
-                               (locale,))
-                continue
+            with metrics.context(locale=locale):
+                self.pull_locale(tx, topic_stats, locale)
 
-            if locale_stats['completed'] == '100%':
-                # get the resource from Tx
-                translation = txlib_too.api.translations.Translation.get(
-                    project_slug=self.tx_project_slug,
-                    slug=self.TOPIC_STRINGS_SLUG,
-                    lang=locale,
-                )
+    def pull_locale(self, tx, topic_stats, locale):
+        """Pull the translated topics for locale, if complete."""
 
-                translated[locale] = babel.messages.pofile.read_po(
-                    StringIO(translation.content.encode('utf-8'))
-                )
+        locale_stats = getattr(topic_stats, locale, None)
+        if locale_stats is None:
+            self.log.debug('Locale %s not present when pulling topics.' %
+                           (locale,))
+            return
+
+        if locale_stats['completed'] == '100%':
+            # get the resource from Tx
+            translation = tx.translation_exists(
+                self.TOPIC_STRINGS_SLUG,
+                locale,
+                project_slug=self.tx_project_slug,
+            )
+            if not translation:
+                self.log.error('Unable to fetch topics for %s.', locale)
+                return
+
+            import po
 
-        # now that we've pulled everything from Tx, upload to Desk
-        for topic in self.desk.topics():
+            # only the msgid -> msgstr mapping for one locale is kept
+            # in memory at a time
+            translated = po.read_translations(translation.content)
 
-            for locale in translated:
+            self.update_topics(locale, translated)
 
-                if topic.name in translated[locale]:
+    def update_topics(self, locale, translated):
+        """Upload the translated topic names for locale to Desk.
 
+        Only translations whose name differs from Desk are written.
+        """
+
+        up_to_date = 0
+
+        for topic in self.topics.topics():
+
+            if topic.name in translated:
+
+                if self.topics.write_translation(
+                        self.plan, topic, locale, name=translated[topic.name]):
                     self.log.debug(
-                        'Updating topic (%s) for locale (%s)' %
+                        'Updated topic (%s) for locale (%s)' %
                         (topic.name, locale),
                     )
-
-                    if locale in topic.translations:
-                        topic.translations[locale].update(
-                            name=translated[locale][topic.name].string,
-                        )
-                    else:
-                        topic.translations.create(
-                            locale=locale,
-                            name=translated[locale][topic.name].string,
-                        )
                 else:
+                    up_to_date += 1
+            else:
 
-                    self.log.error(
-                        'Topic name (%s) does not exist in locale (%s)' %
-                        (topic['name'], locale),
-                    )
+                self.log.error(
+                    'Topic name (%s) does not exist in locale (%s)' %
+                    (topic.name, locale),
+                )
+
+        self.log.info('%d topics already up to date for %s.',
+                      up_to_date, locale)
 
 
 class DeskTutorials(DeskTxSync):
 
+    name = 'tutorials'
+
     def __init__(self, *args, **kwargs):
 
+        from django.conf import settings
+
         super(DeskTutorials, self).__init__(settings.TUTORIALS_PROJECT_SLUG,
                                             *args, **kwargs)
 
@@ -290,35 +437,12 @@ class DeskTutorials(DeskTxSync):
     def make_resource_document(self, title, content, tags=[],):
         """Return a single HTML document containing the title and content."""
 
-        assert "<html>" not in content
-        assert "<body>" not in content
-
-        return """
-        <html>
-        <head><title>%(title)s</title></head>
-        <body>
-        %(content)s
-        </body>
-        """ % dict(
-            title=title,
-            content=content,
-        )
+        return codec.encode_document(title, content)
 
     def parse_resource_document(self, content):
-        """Return a dict with the keys title, content, tags for content."""
-
-        content = content.strip()
+        """Return a dict with the keys subject and body for content."""
 
-        if not content.startswith('<html>'):
-            # this is not a full HTML doc, probably content w/o title, tags, etc
-            return dict(body=content)
-
-        result = {}
-        if '<title>' in content and '</title>' in content:
-            result['subject'] = content[content.find('<title>') + 7:content.find('</title>')].strip()
-        result['body'] = content[content.find('<body>') + 6:content.find('</body>')].strip()
-
-        return result
+        return codec.decode_document(content)
 
     def desk_to_our_locale(self, desk_locale):
 
@@ -334,65 +458,143 @@ class DeskTutorials(DeskTxSync):
     def push(self):
         """Push tutorials to Transifex."""
 
-        tx = Tx(self.tx_project_slug)
+        tx = self.make_tx()
+        state = StateStore(self.options.state_file, read_only=self.plan.dry_run)
 
+        scan = None
         if self.options.resources:
             articles = [
                 self.desk.articles().by_id(r.strip())
                 for r in self.options.resources.split(',')
             ]
         else:
-            articles = self.desk.articles()
+            articles = scan = self.scan_articles(state, 'push')
+
+            # a full push touches every locale project; list them up front
+            if scan.since is None:
+                tx.warm_project_cache()
+
+        # read articles from Desk, build their documents and upload them
+        # to Tx in separate stages, so reads overlap with writes
+        workers = self.options.workers
+        try:
+            Pipeline(self.log, queue_size=2 * workers).run(
+                (a for a in articles if self.shard.owns(a.api_href.rsplit('/', 1)[1])),
+                [
+                    ('build', workers, self.article_uploads),
+                    ('upload', workers,
+                     lambda upload: self.push_upload(tx, state, upload)),
+                ],
+            )
 
-        for a in articles:
+            if scan is not None:
+                self.save_watermark(state, 'push', scan)
+        finally:
+            state.save()
 
-            self.log.debug(
-                'Inspecting Desk resource %s', a.api_href
-            )
+    def push_article(self, tx, state, a):
+        """Push each enabled translation of the Desk article a to Transifex."""
 
-            for translation in a.translations.items().values():
-                our_locale = self.desk_to_our_locale(translation.locale)
+        for upload in self.article_uploads(a):
+            self.push_upload(tx, state, upload)
 
-                self.log.debug('Checking locale %s', translation.locale)
+    def article_uploads(self, a):
+        """Return the push_translation arguments for each translation of a.
 
-                if not self._process_locale(translation.locale):
-                    self.log.debug('Skipping locale.')
-                    continue
+        Only the enabled translations are included; the document is
+        built once and shared by them.
+        """
 
-                # make sure the project exists in Tx
-                tx.get_project(our_locale)
+        self.log.debug(
+            'Inspecting Desk resource %s', a.api_href
+        )
 
-                a_id = a.api_href.rsplit('/', 1)[1]
-                if (
-                    self.options.force or
-                    not tx.resource_exists(a_id, our_locale) or
-                    translation.outdated
-                ):
-                    self.log.info(
-                        'Resource %s out of date in %s; updating.',
-                        a_id,
-                        our_locale,
-                    )
+        a_id = a.api_href.rsplit('/', 1)[1]
+        title = self.make_resource_title(a)
+        document = self.make_resource_document(a.subject, a.body)
+        document_hash = content_hash(document)
 
-                    tx.create_or_update_resource(
-                        a_id,
-                        our_locale,
-                        self.make_resource_title(a),
-                        self.make_resource_document(a.subject, a.body),
-                    )
+        uploads = []
+        for translation in a.translations.items().values():
+            our_locale = self.desk_to_our_locale(translation.locale)
+
+            self.log.debug('Checking locale %s', translation.locale)
+
+            if not self._process_locale(translation.locale):
+                self.log.debug('Skipping locale.')
+                continue
+
+            uploads.append((
+                a_id, our_locale, translation.outdated,
+                title, document, document_hash,
+            ))
+
+        return uploads
+
+    def push_upload(self, tx, state, upload):
+        """Call push_translation with upload, from article_uploads."""
+
+        with metrics.context(locale=upload[1]):
+            self.push_translation(tx, state, *upload)
+
+    def push_translation(self, tx, state, a_id, our_locale, outdated,
+                         title, document, document_hash):
+        """Create or update the Tx resource for an article in our_locale."""
+
+        state_key = '%s:%s' % (a_id, our_locale)
+        pushed = state.get('push', state_key)
+        if (
+            not self.options.force and
+            pushed and pushed['hash'] == document_hash
+        ):
+            self.log.debug(
+                'Resource %s unchanged in %s since last push; skipping.',
+                a_id,
+                our_locale,
+            )
+            self.plan.unchanged('transifex', our_locale, 'resource %s' % (a_id, ))
+            return
+
+        # make sure the project exists in Tx
+        tx.get_project(our_locale)
+
+        resource = tx.resource_exists(a_id, our_locale)
+        if (
+            self.options.force or
+            not resource or
+            outdated
+        ):
+            self.log.info(
+                'Resource %s out of date in %s; updating.',
+                a_id,
+                our_locale,
+            )
+
+            if resource:
+                tx.update_resource(resource, title, document,
+                                   lang=our_locale)
+            else:
+                tx.create_resource(a_id, our_locale, title, document)
+        else:
+            self.plan.skip('transifex', our_locale, 'resource %s' % (a_id, ))
+
+        state.set('push', state_key, {
+            'hash': document_hash,
+            'synced': time.time(),
+        })
 
     def is_complete(self, tx, lang, resource_slug):
 
-        statistics = tx.resource_statistics(resource_slug, lang)
-        lang_statistics = getattr(statistics, lang, None)
+        lang_statistics = tx.translation_statistics(resource_slug, lang)
 
         return lang_statistics and lang_statistics['completed'] == '100%'
 
     def pull(self):
         "Pull Tutorials from Transifex to Desk."""
 
-        tx = Tx(self.tx_project_slug)
+        tx = self.make_tx(cache=TranslationCache(self.options.cache_dir))
 
+        locales = []
         for lang in self.enabled_locales:
 
             self.log.debug('Pulling tutorials for %s', lang)
@@ -401,46 +603,209 @@ class DeskTutorials(DeskTxSync):
                 self.log.debug('Skipping locale %s', lang)
                 continue
 
-            try:
-                resources = tx.list_resources(lang)
-            except NotFoundError:
-                self.log.error('No project found for locale %s', lang)
-                continue
+            locales.append(lang)
+
+        # translations applied so far are checkpointed as they are written
+        journal = Journal(
+            self.options.journal,
+            resume=self.options.resume,
+            read_only=self.plan.dry_run,
+        )
+        state = StateStore(self.options.state_file, read_only=self.plan.dry_run)
+
+        with WorkerPool(self.log, self.options.workers) as pool:
+
+            # fan out the resource listings for each locale, then group
+            # the resources by slug so each Desk article is loaded once
+            pull_langs = collections.OrderedDict()
+            summaries = {}
+            for lang, (slugs, summary) in pool.run(
+                    lambda lang, log: self.list_pull_resources(tx, state, lang, log),
+                    locales,
+                    context=lambda lang: dict(locale=lang),
+            ):
+                summaries[lang] = summary
+                for slug in slugs:
+                    pull_langs.setdefault(slug, []).append(lang)
+
+            for _, failures in pool.run(
+                    lambda slug, log: self.pull_article(
+                        tx, journal, slug, pull_langs[slug], log,
+                    ),
+                    pull_langs,
+            ):
+                for item, error in failures:
+                    pool.fail(item, error, label=' '.join)
+
+        # a failed article fails each of its locales; a locale whose
+        # listing failed has no summary to save
+        failed_langs = set()
+        for item, _, _ in pool.failures:
+            if isinstance(item, tuple):
+                failed_langs.add(item[0])
+            else:
+                failed_langs.update(pull_langs.get(item, ()))
+
+        # the next pull skips the locales pulled in full, unless they change
+        for lang, summary in summaries.items():
+            if summary is not None and lang not in failed_langs:
+                state.set(LOCALE_SUMMARY, tx.get_project_slug(lang), summary)
+                state.set(LOCALE_PULLED, tx.get_project_slug(lang), time.time())
+        state.save()
+
+        # keep the journal to resume from unless everything was pulled
+        journal.close(completed=pool.report())
+
+    def list_pull_resources(self, tx, state, lang, log):
+        """Return the slugs of the Tx resources to consider pulling for lang.
+
+        With --resources only the listed resources are looked up, rather
+        than listing every resource in the project. Resources of other
+        shards are left out. None are listed if lang's locale summary
+        is the same as when it was last pulled in full, unless that was
+        more than --full-pull-interval hours ago.
+
+        Returns the slugs and the summary, if the whole locale is pulled.
+        """
+
+        from txlib_too.http.exceptions import NotFoundError
+
+        pull_resources = summary = None
+        if self.options.resources:
+            pull_resources = set(
+                r.strip() for r in self.options.resources.split(',')
+            )
+        else:
+            project_slug = tx.get_project_slug(lang)
+            summary = tx.locale_summary(lang)
+            pulled_at = state.get(LOCALE_PULLED, project_slug) or 0
+            if (
+                not self.options.force and summary is not None and
+                summary == state.get(LOCALE_SUMMARY, project_slug) and
+                time.time() - pulled_at < self.options.full_pull_interval * 3600
+            ):
+                log.info('Nothing translated in %s since the last pull; skipping.', lang)
+                return [], summary
+
+        try:
+            slugs = [
+                resource['slug']
+                for resource in tx.iter_resources(lang, slugs=pull_resources)
+                if self.shard.owns(resource['slug'])
+            ]
+        except NotFoundError:
+            log.error('No project found for locale %s', lang)
+            return [], None
+
+        # index completion for the whole locale in one request if possible
+        if tx.prefetch_statistics(lang, slugs):
+            log.debug('All resources complete for %s', lang)
+
+        return slugs, summary
+
+    def pull_article(self, tx, journal, slug, langs, log):
+        """Copy the complete translations of the resource slug to Desk.
+
+        The Desk article is loaded at most once, however many locales
+        are pulled for it. Each translation written is recorded in
+        journal with the hash of its content; translations recorded
+        there are skipped, unless they have changed in Tx since.
+        Returns a list of ((lang, slug), error) tuples for the locales
+        that failed.
+        """
 
-            if self.options.resources:
-                pull_resources = [
-                    r.strip() for r in self.options.resources.split(',')
-                ]
+        desk_translations = None
+        failures = []
 
-                resources = [
-                    r for r in resources
-                    if r['slug'] in pull_resources
-                ]
+        for lang in langs:
 
-            for resource in resources:
+            journal_key = '%s:%s' % (slug, lang)
+            applied = journal.get('pull', journal_key)
 
-                if self.is_complete(tx, lang, resource['slug']):
+            with metrics.context(locale=lang):
+                try:
+                    if not self.is_complete(tx, lang, slug):
+                        self.plan.skip('desk', lang, 'article %s' % (slug, ))
+                        continue
+
+                    translation = tx.translation_exists(slug, lang)
+                    if not translation:
+                        log.error('Translation of %s in %s not found.', slug, lang)
+                        failures.append(((lang, slug), 'translation not found'))
+                        continue
 
-                    self.log.info('Pulling translation for %s in %s' % (resource['slug'], lang))
+                    content_digest = content_hash(translation.content)
+                    if applied and applied.get('hash') == content_digest:
+                        log.debug('Translation of %s in %s already applied; skipping.',
+                                  slug, lang)
+                        self.plan.skip('desk', lang, 'article %s' % (slug, ))
+                        continue
 
-                    translation = tx.translation_exists(resource['slug'], lang)
+                    log.info('Pulling translation for %s in %s' % (slug, lang))
 
                     desk_translation = self.parse_resource_document(translation.content)
 
-                    desk_article = self.desk.articles().by_id(resource['slug'])
-                    desk_translations = desk_article.translations
+                    if desk_translations is None:
+                        desk_translations = self.desk.articles().by_id(slug).translations
+
+                    target = 'article %s' % (slug, )
                     if self.desk_locale(lang) in desk_translations:
-                        desk_translations[self.desk_locale(lang)].update(
-                            **desk_translation
-                        )
+                        existing = desk_translations[self.desk_locale(lang)]
+                        if unchanged(existing, desk_translation):
+                            log.debug('Translation of %s in %s unchanged in Desk.',
+                                      slug, lang)
+                            self.plan.unchanged('desk', lang, target)
+                        else:
+                            self.plan.write(
+                                'desk', lang, UPDATE, target,
+                                existing.update,
+                                **desk_translation
+                            )
                     else:
-                        desk_translations.create(
+                        self.plan.write(
+                            'desk', lang, CREATE, target,
+                            desk_translations.create,
                             locale=self.desk_locale(lang),
                             **desk_translation
                         )
 
+                    if not self.plan.dry_run:
+                        journal.record('pull', journal_key, {
+                            'hash': content_digest,
+                            'synced': time.time(),
+                        })
+
+                except Exception as e:
+                    log.exception('Failed pulling %s in %s: %s', slug, lang, e)
+                    failures.append(((lang, slug), e))
+
+        return failures
+
+
+def desk_client(concurrency=DEFAULT_CONCURRENCY):
+    """Return a Desk API client for the configured site.
+
+    The client's connection pool holds up to concurrency connections;
+    one client can be shared by every handler of a run.
+    """
 
-def parse_args():
+    from deskapi.models import DeskApi2
+    from django.conf import settings
+
+    from connections import desk_session
+
+    return DeskApi2(
+        sitename=settings.DESK_SITENAME,
+        session=desk_session(
+            (settings.DESK_USER, settings.DESK_PASSWD),
+            base_url=getattr(settings, 'DESK_BASE_URL', None),
+            pool_size=concurrency,
+        ),
+    )
+
+
+def make_parser():
+    """Return the option parser for the shuttle command line."""
 
     parser = optparse.OptionParser()
     parser.add_option("-t", "--types", type="choice",
@@ -461,8 +826,95 @@ def parse_args():
         help="Comma delimited list of Desk Resource IDs to sync (only supported for tutorials)",
     )
     parser.add_option('--force', action='store_true', help='Always push to Tx even if not out of date.')
+    parser.add_option(
+        '-w', '--workers', action='store', type='int', default=1,
+        help="Number of locales/resources to process concurrently (only supported for tutorials push and pull)",
+    )
+    parser.add_option(
+        '--concurrency', action='store', type='int', default=DEFAULT_CONCURRENCY,
+        help="Maximum number of requests in flight at once, across all handlers",
+    )
+    parser.add_option(
+        '--rate-limit', action='store', type='float', default=DEFAULT_RATE,
+        help="Maximum requests per second to each of Desk and Transifex",
+    )
+    parser.add_option(
+        '--connect-timeout', action='store', type='float', default=DEFAULT_TIMEOUT[0],
+        help="Seconds to wait for a connection to Desk or Transifex",
+    )
+    parser.add_option(
+        '--read-timeout', action='store', type='float', default=DEFAULT_TIMEOUT[1],
+        help="Seconds to wait for data from Desk or Transifex before retrying or failing",
+    )
+    parser.add_option(
+        '--plan', action='store_true',
+        help="Report the creates, updates and skips a run would make, without writing anything",
+    )
+    parser.add_option(
+        '--metrics-file', action='store',
+        help="Write a JSON summary of the requests made, with latency percentiles, to this file",
+    )
+    parser.add_option(
+        '--state-file', action='store',
+        help="JSON file recording pushed content; unchanged tutorials are skipped on push",
+    )
+    parser.add_option(
+        '--cache-dir', action='store',
+        help="Directory caching downloaded translations; unchanged translations are not downloaded again",
+    )
+    parser.add_option(
+        '--full-scan', action='store_true',
+        help="List every Desk article, rather than those updated since the last complete run in --state-file",
+    )
+    parser.add_option(
+        '--full-pull-interval', action='store', type='float', default=DEFAULT_FULL_PULL_INTERVAL,
+        help="Hours after which a tutorials pull lists every resource of a locale, even if its summary is unchanged",
+    )
+    parser.add_option(
+        '--journal', action='store',
+        help="File checkpointing the translations applied by a tutorials pull; removed once a pull completes",
+    )
+    parser.add_option(
+        '--resume', action='store_true',
+        help="Skip translations already applied according to --journal, after an interrupted pull",
+    )
+
+    parser.add_option(
+        '--profile', action='store', metavar='DIR',
+        help="Run the handlers one at a time, writing a profile and sampled stacks of each push and pull to DIR",
+    )
+    parser.add_option(
+        '--shard', action='callback', type='string', dest='shard',
+        default=Shard(), callback=_shard_option, metavar='K/N',
+        help="Sync only the Kth of N slices of the articles and locales; give each shard its own --state-file",
+    )
+    parser.add_option(
+        '--lease-dir', action='store',
+        help="Directory, shared by all shards, of the leases guarding project creation and the topics upload",
+    )
+
+    return parser
+
+
+def _shard_option(option, opt_str, value, parser):
+
+    try:
+        setattr(parser.values, option.dest, Shard.parse(value))
+    except ValueError as e:
+        raise optparse.OptionValueError('%s: %s' % (opt_str, e))
 
-    return parser.parse_args()
+
+def parse_args(args=None):
+
+    parser = make_parser()
+
+    options, args = parser.parse_args(args)
+    if options.resume and not options.journal:
+        parser.error('--resume requires --journal')
+    if options.shard.count > 1 and not options.lease_dir:
+        parser.error('--shard requires --lease-dir')
+
+    return options, args
 
 
 HANDLERS = dict(
@@ -472,47 +924,143 @@ HANDLERS = dict(
     english_tutorials=DeskEnglishTutorials,
 )
 
+# handlers which may only start once another handler has finished
+HANDLER_DEPENDENCIES = dict(
+    english_topics='topics',
+    english_tutorials='tutorials',
+)
+
 
-def main():
+def run_handlers(sync_types, options, log, profiler=None):
+    """Run the handlers in sync_types, a dict of name -> handler.
+
+    Each handler runs in its own thread, so independent handlers run
+    side by side; a handler listed in HANDLER_DEPENDENCIES waits for its
+    dependency to finish first, and is skipped, as failed, if its
+    dependency failed. When profiling, the handlers run one
+    at a time, so their profiles don't overlap. Returns the names of
+    handlers that failed.
+    """
+
+    profiler = profiler or Profiler()
+    finished = dict((name, threading.Event()) for name in sync_types)
+    failed = []
+
+    def run(name):
+        dependency = HANDLER_DEPENDENCIES.get(name)
+        if dependency in finished:
+            finished[dependency].wait()
+
+            # the dependency failed before recording it finished
+            if dependency in failed:
+                log.error('Skipping %s, as %s failed.', name, dependency)
+                failed.append(name)
+                finished[name].set()
+                return
+
+        try:
+            with metrics.context(handler=name):
+                if options.push:
+                    with profiler.profile(name, 'push'):
+                        sync_types[name].push()
+
+                if options.pull:
+                    with profiler.profile(name, 'pull'):
+                        sync_types[name].pull()
+
+        except Exception:
+            log.exception('Error running %s.', name)
+            failed.append(name)
+
+        finally:
+            finished[name].set()
+
+    # dependencies first, for when the handlers run one at a time
+    threads = [
+        threading.Thread(target=run, args=(name, ), name=name)
+        for name in sorted(
+            sync_types, key=lambda name: (name in HANDLER_DEPENDENCIES, name),
+        )
+    ]
+    for thread in threads:
+        thread.start()
+        if profiler.directory:
+            thread.join()
+    for thread in threads:
+        thread.join()
+
+    return failed
+
+
+def main(args=None):
     log = logging.getLogger()
-    log.addHandler(logging.StreamHandler())
+    log_handler = logging.StreamHandler()
+    log_handler.setFormatter(logging.Formatter('[%(threadName)s] %(message)s'))
+    log.addHandler(log_handler)
     log.setLevel(logging.DEBUG)
 
-    options, args = parse_args()
+    options, args = parse_args(args)
+
+    default_throttle.configure(
+        rate=options.rate_limit,
+        concurrency=options.concurrency,
+        timeout=(options.connect_timeout, options.read_timeout),
+    )
+
+    if options.shard.count > 1:
+        log.info('Syncing shard %s.', options.shard)
 
     locales = options.locales
     if locales:
         locales = [l.strip() for l in locales.split(',')]
 
-    sync_types = []
-    if options.types == 'all':
+    # every handler of this run uses the same Desk client and topic listing
+    desk = desk_client(options.concurrency)
+    topics = TopicSnapshot(desk)
 
-        # add all types
-        for handler in HANDLERS:
-            sync_types.append(
-                HANDLERS[handler](
-                    log,
-                    locales=locales,
-                    options=options,
-                )
-            )
+    plan = Plan(dry_run=options.plan)
+    if options.plan and not (options.push or options.pull):
+        options.push = options.pull = True
 
+    if options.types == 'all':
+        # add all types
+        names = HANDLERS.keys()
     else:
-        sync_types.append(
-            HANDLERS[options.types](
+        names = [options.types]
+
+    sync_types = dict(
+        (
+            name,
+            HANDLERS[name](
                 log,
                 locales=locales,
                 options=options,
-            )
+                topics=topics,
+                plan=plan,
+                desk=desk,
+            ),
         )
+        for name in names
+    )
+
+    profiler = Profiler(options.profile, log)
+    try:
+        failed = run_handlers(sync_types, options, log, profiler)
+    finally:
+        if options.metrics_file:
+            default_request_log.write_summary(options.metrics_file)
+
+        profiler.write_summary()
 
-    for sync in sync_types:
+    default_throttle.report(log)
+    plan.report_avoided(log)
 
-        if options.push:
-            sync.push()
+    if options.plan:
+        plan.report(sys.stdout, workers=options.workers)
 
-        if options.pull:
-            sync.pull()
+    if failed:
+        log.error('Failed handlers: %s', ', '.join(sorted(failed)))
+        sys.exit(1)
 
 
 if __name__ == '__main__':
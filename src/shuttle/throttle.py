@@ -0,0 +1,248 @@
+import collections
+import logging
+import random
+import threading
+import time
+
+
+log = logging.getLogger(__name__)
+
+DEFAULT_RATE = 20.0
+DEFAULT_RETRIES = 5
+DEFAULT_CONCURRENCY = 10
+# seconds to wait to connect, and then between bytes of the response
+DEFAULT_TIMEOUT = (10.0, 60.0)
+
+# responses worth retrying: rate limiting and transient server failures
+RETRYABLE_STATUSES = frozenset((429, 500, 502, 503, 504))
+
+# a POST may have been applied even though it failed, so it is only
+# retried when the server certainly did not act on it
+IDEMPOTENT_METHODS = frozenset(('GET', 'HEAD', 'OPTIONS', 'PUT', 'PATCH', 'DELETE'))
+NOT_APPLIED_STATUSES = frozenset((429, 503))
+
+
+class TokenBucket(object):
+    """Adaptive token bucket limiting the request rate to one host.
+
+    The rate is halved whenever the host throttles us and creeps back
+    up towards max_rate as requests succeed (additive increase,
+    multiplicative decrease).
+    """
+
+    def __init__(self, max_rate, min_rate=0.5):
+
+        self.max_rate = float(max_rate)
+        self.min_rate = min(float(min_rate), self.max_rate)
+        self.rate = self.max_rate
+        self._tokens = self.max_rate
+        self._updated = time.time()
+        self._blocked_until = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request may be sent."""
+
+        while True:
+            with self._lock:
+                now = time.time()
+                if now >= self._blocked_until:
+                    self._tokens = min(
+                        self.rate,
+                        self._tokens + (now - self._updated) * self.rate,
+                    )
+                    self._updated = now
+
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+
+                    wait = (1 - self._tokens) / self.rate
+                else:
+                    wait = self._blocked_until - now
+
+            time.sleep(wait)
+
+    def throttled(self, retry_after=None):
+        """Slow down after the host told us we are sending too much."""
+
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self._tokens = min(self._tokens, self.rate)
+            if retry_after:
+                self._blocked_until = max(
+                    self._blocked_until, time.time() + retry_after,
+                )
+
+    def succeeded(self):
+
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 100)
+
+
+class Throttle(object):
+    """Rate limiting and retries shared by every outgoing request.
+
+    At most ``concurrency`` requests are in flight at once, across all
+    hosts. Requests to each host draw from their own TokenBucket. Retryable
+    failures (connection errors, 429 and 5xx responses) are retried with
+    jittered exponential backoff, honoring Retry-After when given;
+    requests that are not idempotent are only retried if they can't
+    have been applied. The outcome of every attempt is counted in
+    ``stats``. ``timeout`` is the (connect, read) timeout of the
+    sessions sending through the throttle.
+    """
+
+    def __init__(self, rate=DEFAULT_RATE, retries=DEFAULT_RETRIES,
+                 concurrency=DEFAULT_CONCURRENCY, backoff=0.5, max_backoff=60,
+                 timeout=DEFAULT_TIMEOUT):
+
+        self.rate = rate
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.stats = collections.Counter()
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def configure(self, rate=None, retries=None, concurrency=None,
+                  timeout=None):
+
+        with self._lock:
+            if timeout is not None:
+                self.timeout = timeout
+            if rate is not None:
+                self.rate = rate
+                self._buckets = {}
+            if retries is not None:
+                self.retries = retries
+            if concurrency is not None:
+                self.concurrency = concurrency
+                self._slots = threading.BoundedSemaphore(concurrency)
+
+    def bucket(self, host):
+
+        with self._lock:
+            if host not in self._buckets:
+                self._buckets[host] = TokenBucket(self.rate)
+
+            return self._buckets[host]
+
+    def count(self, host, event):
+
+        with self._lock:
+            self.stats['%s %s' % (host, event)] += 1
+
+    def retry_delay(self, attempt, response=None):
+        """Return the number of seconds to wait before the next attempt."""
+
+        retry_after = response is not None and parse_retry_after(
+            response.headers.get('Retry-After'),
+        )
+        if retry_after:
+            return min(retry_after, self.max_backoff)
+
+        return random.uniform(
+            0, min(self.max_backoff, self.backoff * 2 ** attempt),
+        )
+
+    def send(self, host, send_request, method='GET'):
+        """Call send_request() until it succeeds or fails permanently.
+
+        method is the HTTP method of the request. Returns the final
+        response; re-raises the connection error if every attempt
+        failed, or if the request may have been applied.
+        """
+
+        # requests is slow to import; by now the caller has loaded it
+        import requests
+
+        bucket = self.bucket(host)
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+        retryable = RETRYABLE_STATUSES if idempotent else NOT_APPLIED_STATUSES
+
+        for attempt in range(self.retries + 1):
+            bucket.acquire()
+
+            try:
+                with self._slots:
+                    response = send_request()
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self.count(host, 'connection_error')
+                if attempt == self.retries or not (idempotent or connect_failed(e)):
+                    self.count(host, 'gave_up')
+                    raise
+
+                delay = self.retry_delay(attempt)
+                log.warning('%s connecting to %s; retrying in %.1fs.',
+                            e.__class__.__name__, host, delay)
+                time.sleep(delay)
+                continue
+
+            status = response.status_code
+            if status not in RETRYABLE_STATUSES:
+                bucket.succeeded()
+                return response
+
+            self.count(host, str(status))
+            delay = self.retry_delay(attempt, response)
+            if status == 429:
+                bucket.throttled(delay)
+
+            if attempt == self.retries or status not in retryable:
+                self.count(host, 'gave_up')
+                return response
+
+            self.count(host, 'retry')
+            log.warning('%s returned %s for %s; retrying in %.1fs.',
+                        host, status, response.request.url, delay)
+            # a streamed response holds its connection until closed
+            response.close()
+            time.sleep(delay)
+
+    def report(self, log):
+        """Log the counted throttling and retry events."""
+
+        for key, count in sorted(self.stats.items()):
+            log.info('HTTP %s: %d', key, count)
+
+
+def connect_failed(error):
+    """Return True if error means a request never reached the host."""
+
+    import requests
+    from requests.packages.urllib3.exceptions import NewConnectionError
+
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+
+    # refused and unresolved connections come wrapped in a MaxRetryError
+    reason = getattr(error.args[0] if error.args else None, 'reason', None)
+    return isinstance(reason, NewConnectionError)
+
+
+def parse_retry_after(value):
+    """Return the number of seconds a Retry-After header asks us to wait."""
+
+    if not value:
+        return None
+
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+
+    import email.utils
+
+    parsed = email.utils.parsedate_tz(value)
+    if parsed is None:
+        return None
+
+    return max(email.utils.mktime_tz(parsed) - time.time(), 0)
+
+
+# shared by the Desk and Transifex sessions of a run
+default_throttle = Throttle()
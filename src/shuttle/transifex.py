@@ -1,8 +1,15 @@
+import codecs
+import json
+import threading
+
 from django.conf import settings
 from txlib_too import registry
 from txlib_too.http import auth
-from txlib_too.http.exceptions import NotFoundError, RemoteServerError
-from txlib_too.http import http_requests
+from txlib_too.http.exceptions import (
+    ConflictError,
+    NotFoundError,
+    RequestError,
+)
 from txlib_too.api import (
     project,
     resources,
@@ -10,28 +17,154 @@ from txlib_too.api import (
     statistics,
 )
 
+from connections import (
+    DEFAULT_CONCURRENCY,
+    PooledHttpRequest,
+)
+from plan import (
+    CREATE,
+    Plan,
+    UPDATE,
+)
+from shard import Lease
+from state import TranslationCache
+
 LOCALES = ('fr_CA', 'fr_FR', 'es_ES')
 
 UNTRANSLATED_LOCALES = ('en', 'en-us',)
 DEFAULT_SOURCE_LANGUAGE = 'en_US'
 DEFAULT_I18N_TYPE = 'HTML'
 
+# the configuration of the handlers installed by Tx.setup_registry
+_registry_config = {}
+_registry_lock = threading.Lock()
+
+# bytes of a streamed listing decoded at a time
+LISTING_CHUNK_SIZE = 64 * 1024
+
+# the fields of a language summary that change as it is translated
+LANGUAGE_SUMMARY_FIELDS = (
+    'reviewed_segments',
+    'total_segments',
+    'translated_segments',
+    'translated_words',
+    'untranslated_segments',
+)
+
+
+def iter_json_array(chunks):
+    """Yield the items of a JSON array of objects read in byte chunks.
+
+    Items are decoded as soon as they have been read in full, so only
+    one item and the unread part of a chunk are held at a time. Raises
+    ValueError if the chunks end before the array does.
+    """
+
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    buf = u''
+    started = False
+
+    for chunk in chunks:
+        buf += text_decoder.decode(chunk)
+        pos = 0
+
+        while True:
+            # skip whitespace, and the separators between items
+            while pos < len(buf) and buf[pos] in u' \t\r\n,':
+                pos += 1
+
+            if pos == len(buf):
+                break
+
+            if not started:
+                if buf[pos] != u'[':
+                    raise ValueError('Expected a JSON array')
+                started = True
+                pos += 1
+                continue
+
+            if buf[pos] == u']':
+                return
+
+            try:
+                item, pos = decoder.raw_decode(buf, pos)
+            except ValueError:
+                # the item continues in the next chunk
+                break
+
+            yield item
+
+        buf = buf[pos:]
+
+    # a body cut off between items would otherwise look complete
+    raise ValueError('Unterminated JSON array')
+
 
 class Tx(object):
 
-    def __init__(self, project_slug_prefix):
+    def __init__(self, project_slug_prefix, concurrency=None, plan=None,
+                 cache=None, lease_dir=None):
 
         self.__project_slug_prefix = project_slug_prefix
 
-        self.setup_registry()
+        # writes are made through the plan, which skips them in dry runs
+        self.plan = plan or Plan().handler(None)
+
+        # downloaded translations, kept across runs; see translation_exists
+        self.cache = cache or TranslationCache()
+
+        # directory of the leases guarding steps shared with other
+        # processes of a sharded run; see lease
+        self.lease_dir = lease_dir
+
+        # projects seen during this run, by slug; see get_project
+        self._projects = {}
+        self._projects_listed = False
+        self._projects_lock = threading.Lock()
+        # one lock per project slug, so lookups only wait for each other
+        # when they are for the same project
+        self._project_locks = {}
+
+        # per-language resource statistics, by (project slug, slug, lang)
+        self._statistics = {}
+
+        # project-wide language summaries, by (project slug, lang)
+        self._languages = {}
+
+        self.setup_registry(concurrency)
 
     def projects(self):
         """Yield (project, lang) tuples for all help center projects."""
 
-        project.Project._http.get(
-            project.Project._construct_path_to_collection()
+        prefix = '%s-' % (self.__project_slug_prefix, )
+
+        for entry in registry.registry.http_handler.get('/api/2/projects/'):
+            if not entry['slug'].startswith(prefix):
+                continue
+
+            locale_project = project.Project(slug=entry['slug'])
+            locale_project._populated_fields = entry
+
+            yield locale_project, entry['slug'][len(prefix):]
+
+    def warm_project_cache(self):
+        """Load every project for this prefix into the cache in one request.
+
+        Once the listing has been loaded, get_project treats projects
+        missing from it as not existing and creates them without
+        looking them up first.
+        """
+
+        listed = dict(
+            (locale_project.slug, locale_project)
+            for locale_project, lang in self.projects()
         )
 
+        with self._projects_lock:
+            self._projects.update(listed)
+            self._projects_listed = True
+
     def get_project(self, locale, source_language_code=DEFAULT_SOURCE_LANGUAGE, **kwargs):
         """
         Gets or creates the Transifex project for the current project prefix and locale
@@ -45,53 +178,121 @@ class Tx(object):
         :rtype: project.Project
         """
 
-        try:
-            locale_project = project.Project.get(slug=self.get_project_slug(locale))
+        slug = self.get_project_slug(locale)
 
-        except NotFoundError:
+        with self._projects_lock:
+            if slug in self._projects:
+                return self._projects[slug]
 
-            locale_project = project.Project(
-                slug=self.get_project_slug(locale),
-            )
-            defaults = {
-                'name': 'Help Center (%s)' % (locale, ),
-                'description': 'Help Center pages to translate to %s' % (
-                    locale,
-                ),
-                'source_language_code': source_language_code,
-                'private': True,
-            }
+            slug_lock = self._project_locks.setdefault(slug, threading.Lock())
 
-            valid_keys = ('name', 'description')
-            defaults.update(
-                {k: v for k, v in kwargs.items() if k in valid_keys}
-            )
+        # hold the project's lock, and the lease shared with other
+        # processes, while fetching so it is created at most once
+        with slug_lock:
+            with self._projects_lock:
+                locale_project = self._projects.get(slug)
 
-            for k, v in defaults.items():
-                setattr(locale_project, k, v)
+            if locale_project is None:
+                with self.lease('project-%s' % (slug, )):
+                    locale_project = self._get_or_create_project(
+                        locale, source_language_code, **kwargs
+                    )
 
-            locale_project.save()
+                with self._projects_lock:
+                    self._projects[slug] = locale_project
 
         return locale_project
 
+    def _get_or_create_project(self, locale, source_language_code, **kwargs):
+
+        # if the project listing was loaded, a missing project does not
+        # exist, unless another process may have created it since
+        if not self._projects_listed or self.lease_dir:
+            try:
+                return project.Project.get(slug=self.get_project_slug(locale))
+            except NotFoundError:
+                pass
+
+        locale_project = project.Project(
+            slug=self.get_project_slug(locale),
+        )
+        defaults = {
+            'name': 'Help Center (%s)' % (locale, ),
+            'description': 'Help Center pages to translate to %s' % (
+                locale,
+            ),
+            'source_language_code': source_language_code,
+            'private': True,
+        }
+
+        valid_keys = ('name', 'description')
+        defaults.update(
+            {k: v for k, v in kwargs.items() if k in valid_keys}
+        )
+
+        for k, v in defaults.items():
+            setattr(locale_project, k, v)
+
+        try:
+            self.plan.write(
+                'transifex', locale, CREATE,
+                'project %s' % (locale_project.slug, ),
+                locale_project.save,
+            )
+        except (ConflictError, RequestError) as e:
+            error = e
+        else:
+            return locale_project
+
+        # another process may have created the project since it was
+        # listed; use it if so, or report why it couldn't be created
+        try:
+            return project.Project.get(slug=locale_project.slug)
+        except NotFoundError:
+            raise error
+
+    def lease(self, name):
+        """Return a Lease on name shared with the other processes of a run."""
+
+        return Lease(self.lease_dir, name)
+
     def get_project_slug(self, locale):
 
         return "%s-%s" % (self.__project_slug_prefix, locale)
 
-    def setup_registry(self):
+    def setup_registry(self, concurrency=None):
+        """Install the pooled HTTP handler in the txlib_too registry.
 
-        registry.registry.setup(
-            {
-                'http_handler': http_requests.HttpRequest(
-                    settings.TRANSIFEX_HOST,
-                    auth=auth.BasicAuth(
-                        settings.TRANSIFEX_USERNAME,
-                        settings.TRANSIFEX_PASSWORD,
-                    ),
-                ),
-            },
+        The handler is shared by every Tx in the process and is only
+        replaced when the Transifex settings or concurrency change, so
+        its keep-alive connections survive across runs and handlers.
+        """
+
+        config = (
+            settings.TRANSIFEX_HOST,
+            settings.TRANSIFEX_USERNAME,
+            settings.TRANSIFEX_PASSWORD,
+            concurrency or DEFAULT_CONCURRENCY,
         )
 
+        with _registry_lock:
+            if _registry_config.get('http_handler') == config:
+                return
+
+            registry.registry.setup(
+                {
+                    'http_handler': PooledHttpRequest(
+                        settings.TRANSIFEX_HOST,
+                        auth=auth.BasicAuth(
+                            settings.TRANSIFEX_USERNAME,
+                            settings.TRANSIFEX_PASSWORD,
+                        ),
+                        concurrency=config[-1],
+                    ),
+                },
+            )
+            _registry_config['http_handler'] = config
+
     def create_resource(self, slug, lang, name, content,
                         i18n_type=None,
                         project_slug=None):
@@ -104,7 +305,11 @@ class Tx(object):
         resource.name = name
         resource.i18n_type = i18n_type or DEFAULT_I18N_TYPE
         resource.content = content
-        resource.save()
+        self.plan.write(
+            'transifex', lang, CREATE,
+            'resource %s/%s' % (resource.project_slug, slug),
+            resource.save,
+        )
 
         return resource
 
@@ -117,9 +322,18 @@ class Tx(object):
             return self.create_resource(slug, locale, name, content,
                                         i18n_type=i18n_type,
                                         project_slug=project_slug)
+        return self.update_resource(resource, name, content, lang=locale)
+
+    def update_resource(self, resource, name, content, lang=None):
+        """Update an existing resource without fetching it again."""
+
         resource.name = name
         resource.content = content
-        resource.save()
+        self.plan.write(
+            'transifex', lang, UPDATE,
+            'resource %s/%s' % (resource.project_slug, resource.slug),
+            resource.save,
+        )
 
         return resource
 
@@ -135,25 +349,161 @@ class Tx(object):
 
         return stats
 
+    def language_statistics(self, lang, project_slug=None):
+        """Return the project-wide translation summary for lang, or None.
+
+        The summary is fetched once per run.
+        """
+
+        key = (project_slug or self.get_project_slug(lang), lang)
+
+        if key not in self._languages:
+            try:
+                self._languages[key] = registry.registry.http_handler.get(
+                    '/api/2/project/%s/language/%s/?details' % key
+                )
+            except NotFoundError:
+                self._languages[key] = None
+
+        return self._languages[key]
+
+    def locale_summary(self, lang, project_slug=None):
+        """Return a dict summarising the state of lang's translations.
+
+        The summary holds the project's last_updated time and the
+        segment and word counts of lang across the project. These change
+        when strings are pushed, translated or reviewed, but not
+        necessarily when a translated string is corrected, so an equal
+        summary does not prove nothing changed; callers should still
+        pull in full now and then. Returns None if there is no project.
+        """
+
+        project_slug = project_slug or self.get_project_slug(lang)
+
+        try:
+            details = registry.registry.http_handler.get(
+                '/api/2/project/%s/?details' % (project_slug, )
+            )
+        except NotFoundError:
+            return None
+
+        language = self.language_statistics(lang, project_slug=project_slug) or {}
+
+        summary = dict(
+            (field, language.get(field)) for field in LANGUAGE_SUMMARY_FIELDS
+        )
+        summary['last_updated'] = details.get('last_updated')
+
+        return summary
+
+    def prefetch_statistics(self, lang, slugs, project_slug=None):
+        """Index the statistics of the resources slugs in lang.
+
+        Transifex only reports resource statistics one resource at a
+        time, but the language summary tells us in a single request
+        whether every resource in the project is fully translated. When
+        it is, all slugs are indexed as complete; otherwise statistics
+        are left to be fetched per resource by translation_statistics.
+
+        Returns True if the slugs were indexed.
+        """
+
+        project_slug = project_slug or self.get_project_slug(lang)
+
+        summary = self.language_statistics(lang, project_slug=project_slug)
+        if not summary or summary.get('untranslated_segments') != 0:
+            return False
+
+        for slug in slugs:
+            self._statistics[(project_slug, slug, lang)] = {
+                'completed': '100%',
+            }
+
+        return True
+
+    def translation_statistics(self, slug, lang, project_slug=None):
+        """Return the statistics dict for lang in the resource slug.
+
+        Statistics are fetched once per run and kept in an index keyed
+        by (project, slug, lang); None is returned if there are none.
+        """
+
+        key = (project_slug or self.get_project_slug(lang), slug, lang)
+
+        if key not in self._statistics:
+            stats = self.resource_statistics(slug, lang, project_slug=project_slug)
+            self._statistics[key] = getattr(stats, lang, None)
+
+        return self._statistics[key]
+
+    def forget_statistics(self, slug, lang, project_slug=None):
+        """Drop the indexed statistics of slug in lang.
+
+        The next translation_statistics call fetches them again; used by
+        long-running processes waiting for a translation to complete.
+        """
+
+        self._statistics.pop(
+            (project_slug or self.get_project_slug(lang), slug, lang), None,
+        )
+
     def delete_resource(self, slug, locale):
         resource = self.resource_exists(slug, locale)
         if resource:
             resource.delete()
 
     def translation_exists(self, slug, lang, project_slug=None):
-        """Return True if the translation exists for this slug."""
+        """Return the translation for this slug, or False if there is none.
+
+        A cached translation is returned without a request if its
+        last_update matches the indexed statistics; otherwise, as for
+        locales indexed complete from their summary, which carry no
+        last_update, it is revalidated with its ETag, and only
+        downloaded again if it changed. Server errors that persist after retrying are raised
+        rather than reported as a missing translation.
+        """
+
+        key = (project_slug or self.get_project_slug(lang), slug, lang)
+        cached = self.cache.get(key)
+        last_update = (self._statistics.get(key) or {}).get('last_update')
+
+        if cached and last_update and cached.get('last_update') == last_update:
+            return self._translation(key, cached['content'])
+
+        headers = {}
+        if cached and cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
 
         try:
-            return translations.Translation.get(
-                project_slug=project_slug or self.get_project_slug(lang),
-                slug=slug,
-                lang=lang,
+            response = registry.registry.http_handler.get_response(
+                '/api/2/project/%s/resource/%s/translation/%s/' % key,
+                headers=headers,
             )
+        except NotFoundError:
+            return False
 
-        except (NotFoundError, RemoteServerError):
-            pass
+        if response.status_code == 304:
+            content = cached['content']
+        else:
+            content = json.loads(response.content.decode('utf-8'))['content']
+
+        self.cache.set(key, {
+            'content': content,
+            'etag': response.headers.get('ETag'),
+            'last_update': last_update,
+        })
+
+        return self._translation(key, content)
+
+    def _translation(self, key, content):
+
+        project_slug, slug, lang = key
+        translation = translations.Translation(
+            project_slug=project_slug, slug=slug, lang=lang,
+        )
+        translation._populated_fields = {'content': content}
 
-        return False
+        return translation
 
     def list_resources(self, lang, project_slug=None):
         """Return a sequence of resources for a given lang.
@@ -167,6 +517,46 @@ class Tx(object):
                 project_slug,)
         )
 
+    def iter_resources(self, lang, slugs=None, project_slug=None):
+        """Yield the resources of the project for lang, as dicts.
+
+        The listing is decoded as it is downloaded, so the resources of
+        a large project are never all held in memory. If slugs is given
+        only those resources are fetched, one at a time, instead of
+        listing the whole project; slugs that do not exist are skipped.
+        Raises NotFoundError if the project does not exist.
+        """
+
+        project_slug = project_slug or self.get_project_slug(lang)
+        http_handler = registry.registry.http_handler
+
+        if slugs is not None:
+            # check the project once, so a missing project is reported
+            # as such rather than as every slug missing
+            if project_slug not in self._projects:
+                http_handler.get('/api/2/project/%s/' % (project_slug, ))
+
+            for slug in slugs:
+                try:
+                    yield http_handler.get(
+                        '/api/2/project/%s/resource/%s/' % (project_slug, slug)
+                    )
+                except NotFoundError:
+                    pass
+
+            return
+
+        response = http_handler.get_response(
+            '/api/2/project/%s/resources/' % (project_slug, ),
+            stream=True,
+        )
+        try:
+            for resource in iter_json_array(
+                    response.iter_content(LISTING_CHUNK_SIZE)):
+                yield resource
+        finally:
+            response.close()
+
     def resources(self, lang, slug, project_slug=None):
         """Generate a list of Resources in the Project.
 
@@ -0,0 +1,247 @@
+import logging
+import Queue
+import sys
+import threading
+
+import metrics
+
+
+# the number of items each queue of a Pipeline holds before blocking
+DEFAULT_QUEUE_SIZE = 16
+
+# the end of the items in a Pipeline queue, once for each reader
+_DONE = object()
+
+
+class BufferedLog(object):
+    """Collect log calls for one work item and emit them together.
+
+    When several items are processed concurrently their log lines would
+    otherwise interleave; buffering keeps each item's lines contiguous
+    and prefixed with the item's label.
+    """
+
+    def __init__(self, log, label):
+
+        self._log = log
+        self._label = label
+        self._records = []
+
+    def _record(self, level, msg, args, exc_info=None):
+
+        self._records.append((level, '[%s] %s' % (self._label, msg), args, exc_info))
+
+    def debug(self, msg, *args):
+        self._record(logging.DEBUG, msg, args)
+
+    def info(self, msg, *args):
+        self._record(logging.INFO, msg, args)
+
+    def warning(self, msg, *args):
+        self._record(logging.WARNING, msg, args)
+
+    def error(self, msg, *args):
+        self._record(logging.ERROR, msg, args)
+
+    def exception(self, msg, *args):
+        self._record(logging.ERROR, msg, args, exc_info=sys.exc_info())
+
+    def flush(self):
+        """Emit all buffered records to the underlying log."""
+
+        records, self._records = self._records, []
+        for level, msg, args, exc_info in records:
+            self._log.log(level, msg, *args, exc_info=exc_info)
+
+
+class WorkerPool(object):
+    """Run work items on a bounded pool of threads.
+
+    A failing item is logged and recorded in ``failures``, as an
+    (item, label, error) tuple; it does not stop the remaining items
+    from being processed. With a single worker
+    items are processed inline, in order.
+    """
+
+    def __init__(self, log, workers=1):
+
+        self.log = log
+        self.workers = max(int(workers or 1), 1)
+        self.failures = []
+        self._pool = None
+
+    def __enter__(self):
+
+        if self.workers > 1:
+            from multiprocessing.pool import ThreadPool
+
+            self._pool = ThreadPool(self.workers)
+
+        return self
+
+    def __exit__(self, *exc_info):
+
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def run(self, func, items, label=str, context=None):
+        """Call func(item, log) for each item.
+
+        Yields (item, result) for every item that succeeded, in the order
+        the items were given. ``log`` is a BufferedLog labelled with
+        label(item); it is flushed as each item's result is yielded.
+        Requests made by func are attributed to the caller's metrics
+        context, updated with context(item) if given.
+        """
+
+        run_context = metrics.current_context()
+
+        def call(item):
+            log = BufferedLog(self.log, label(item))
+            item_context = dict(run_context, **(context(item) if context else {}))
+            try:
+                with metrics.context(**item_context):
+                    return item, True, func(item, log), log
+            except Exception as e:
+                log.exception('Failed: %s', e)
+                return item, False, e, log
+
+        if self._pool is None:
+            results = (call(item) for item in items)
+        else:
+            results = self._pool.imap(call, items)
+
+        for item, ok, result, log in results:
+            log.flush()
+
+            if ok:
+                yield item, result
+            else:
+                self.fail(item, result, label)
+
+    def fail(self, item, error, label=str):
+        """Record that item failed with error, for report()."""
+
+        self.failures.append((item, label(item), error))
+
+    def report(self):
+        """Log a summary of failed items; return True if there were none."""
+
+        if not self.failures:
+            return True
+
+        self.log.error('%d item(s) failed:', len(self.failures))
+        for _, label, error in self.failures:
+            self.log.error('  %s: %s', label, error)
+
+        return False
+
+
+class Pipeline(object):
+    """Stream items through stages of threads connected by bounded queues.
+
+    Stages are (name, threads, func) tuples. The first stage takes the
+    items of the source, which is read in a thread of its own; each
+    func(item) returns an iterable of items for the next stage, and
+    the results of the last stage are discarded. A stage blocks while
+    the queue it feeds is full, so the stages overlap but only a
+    bounded number of items is held at once, however many the source
+    yields.
+
+    The first error stops the pipeline: the source is no longer read
+    and queued items are discarded. run() raises the error once every
+    thread has finished.
+    """
+
+    def __init__(self, log, queue_size=DEFAULT_QUEUE_SIZE):
+
+        self.log = log
+        self.queue_size = queue_size
+        self.error = None
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+
+    def run(self, source, stages):
+        """Feed the items of source through stages, and wait for them."""
+
+        run_context = metrics.current_context()
+        queues = [Queue.Queue(self.queue_size) for _ in stages]
+        # the threads of each stage still reading from its queue
+        running = [threads for _, threads, _ in stages]
+        prefix = threading.current_thread().name
+
+        def feed(items, queue):
+            for item in items:
+                if self._stopped.is_set():
+                    break
+                queue.put(item)
+
+        def finish(index):
+            if index < len(stages):
+                for _ in range(stages[index][1]):
+                    queues[index].put(_DONE)
+
+        def read():
+            try:
+                with metrics.context(**run_context):
+                    feed(source, queues[0])
+            except Exception as e:
+                self._fail('read', e)
+            finally:
+                finish(0)
+
+        def work(index):
+            name, _, func = stages[index]
+            while True:
+                item = queues[index].get()
+                if item is _DONE:
+                    break
+
+                # keep draining after an error, so no stage blocks on a full queue
+                if self._stopped.is_set():
+                    continue
+
+                try:
+                    with metrics.context(**run_context):
+                        results = func(item)
+                        if index + 1 < len(stages):
+                            feed(results or (), queues[index + 1])
+                except Exception as e:
+                    self._fail(name, e)
+
+            with self._lock:
+                running[index] -= 1
+                last = not running[index]
+            if last:
+                finish(index + 1)
+
+        threads = [threading.Thread(target=read, name='%s-read' % (prefix, ))]
+        for index, (name, count, _) in enumerate(stages):
+            threads.extend(
+                threading.Thread(
+                    target=work, args=(index, ),
+                    name='%s-%s%s' % (prefix, name, '-%d' % (n + 1, ) if count > 1 else ''),
+                )
+                for n in range(count)
+            )
+
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if self.error is not None:
+            raise self.error
+
+    def _fail(self, name, error):
+
+        self.log.exception('Error in %s: %s', name, error)
+
+        with self._lock:
+            if self.error is None:
+                self.error = error
+
+        self._stopped.set()